@@ -1,10 +1,12 @@
 from datetime import timedelta
 
-from crawler.analyzers.analyzer import Analyzer
+import numpy as np
+
+from crawler.analyzers.analyzer import PanelAnalyzer, BacktestAnalyzer
 from crawler.models import Share
 
 
-class AirAnalyzer(Analyzer):
+class AirAnalyzer(PanelAnalyzer, BacktestAnalyzer):
     def __init__(self, threshold=5):
         self.threshold = threshold
 
@@ -35,3 +37,53 @@ class AirAnalyzer(Analyzer):
         if last_month_history['close'].max() * 0.9 >= last_month_history['low'].min() == last_day_history[
             'low'] and len(last_month_history) > 10:
             return {"monthly lower bound": {"price": last_day_history['low']}}
+
+    def analyze_market(self, market):
+        high, low, close = market.adjusted['high'], market.adjusted['low'], market.adjusted['close']
+        last_high, last_low = market.last(market.raw['high']), market.last(market.raw['low'])
+        history, last_month, half_year = (market.get_window(), market.get_window(since=market.today - timedelta(days=30)),
+                                          market.get_window(since=market.today - timedelta(days=180)))
+        long_history = half_year[1] - half_year[0] > 60
+
+        checked = ~market.get_flags(lambda share: share.base_share_id) & (
+                market.first(market.days) < market.get_day(market.today - timedelta(days=self.threshold)))
+        aired = checked & (market.reduce(np.maximum, high, history) == last_high) & long_history & (
+                market.count(high == market.repeat(last_high), last_month) == 1)
+        # any day of the last month at the low counts, as analyze checks the length of a filtered frame
+        dumped = checked & (market.reduce(np.minimum, low, history) == last_low) & long_history & (
+                market.count(low == market.repeat(last_low), last_month) > 0)
+        half_year_low = market.reduce(np.minimum, low, half_year)
+        half_year_bound = checked & (market.reduce(np.maximum, close, half_year) * 0.8 >= half_year_low) & (
+                half_year_low == last_low) & long_history
+        last_month_low = market.reduce(np.minimum, low, last_month)
+        monthly_bound = checked & (market.reduce(np.maximum, close, last_month) * 0.9 >= last_month_low) & (
+                last_month_low == last_low) & (last_month[1] - last_month[0] > 10)
+
+        return {"aired": (aired, {"price": last_high}), "dumped": (dumped, {"price": last_low}),
+                "half year lower bound": (half_year_bound, {"price": last_low}),
+                "monthly lower bound": (monthly_bound, {"price": last_low})}
+
+    def analyze_timeline(self, timeline, timelines):
+        if timeline.asset.base_share_id:
+            return {}
+
+        high, low, close = timeline.forward['high'], timeline.forward['low'], timeline.forward['close']
+        last_month, half_year = timeline.get_starts(days=30), timeline.get_starts(days=180)
+        long_history = timeline.rows + 1 - half_year > 60
+
+        checked = timeline.days[0] < timeline.days - self.threshold
+        aired = checked & (np.maximum.accumulate(high) == high) & long_history & (
+                timeline.count_equal(high, last_month) == 1)
+        # any day of the last month at the low counts, as analyze checks the length of a filtered frame
+        dumped = checked & (np.minimum.accumulate(low) == low) & long_history & (
+                timeline.count_equal(low, last_month) > 0)
+        half_year_low = timeline.reduce_window(np.minimum, low, half_year)
+        half_year_bound = checked & (timeline.reduce_window(np.maximum, close, half_year) * 0.8 >= half_year_low) & (
+                half_year_low == low) & long_history
+        last_month_low = timeline.reduce_window(np.minimum, low, last_month)
+        monthly_bound = checked & (timeline.reduce_window(np.maximum, close, last_month) * 0.9 >= last_month_low) & (
+                last_month_low == low) & (timeline.rows + 1 - last_month > 10)
+
+        return {"aired": (aired, {"price": timeline.raw['high']}), "dumped": (dumped, {"price": timeline.raw['low']}),
+                "half year lower bound": (half_year_bound, {"price": timeline.raw['low']}),
+                "monthly lower bound": (monthly_bound, {"price": timeline.raw['low']})}
@@ -1,7 +1,55 @@
 from abc import ABC, abstractmethod
 
+import numpy as np
+
 
 class Analyzer(ABC):
+    def prepare(self, shares: list, day_offset: int):
+        """Called once with the shares about to be analyzed, before analyze is called for each of them."""
+
     @abstractmethod
     def analyze(self, share, day_offset: int):
         raise NotImplementedError()
+
+
+class PanelAnalyzer(Analyzer):
+    """Analyzer whose signals are also computed for all assets of a market panel at once."""
+
+    @abstractmethod
+    def analyze_market(self, market) -> dict[str, tuple[np.ndarray, dict[str, np.ndarray]]]:
+        """Boolean column of the assets raising each signal with its payload columns, in the order analyze checks them."""
+        raise NotImplementedError()
+
+    def get_results(self, market) -> dict[int, dict]:
+        """Results of analyze for the assets of the market by their id, assets without a signal are left out."""
+        results = {}
+        for signal, (mask, payload) in self.analyze_market(market).items():
+            for loc in np.flatnonzero(mask).tolist():
+                results.setdefault(market.assets[loc].pk, {signal: get_payload(payload, loc)})
+        return results
+
+
+class BacktestAnalyzer(Analyzer):
+    """Analyzer whose signals are also computed for every day of an asset timeline in one pass."""
+
+    @abstractmethod
+    def analyze_timeline(self, timeline, timelines: dict) -> dict[str, tuple[np.ndarray, dict[str, np.ndarray]]]:
+        """
+        Boolean column of the days raising each signal with its payload columns, in the order analyze checks them.
+        Timelines of other assets are looked up by their primary key.
+        """
+        raise NotImplementedError()
+
+    def get_signals(self, timeline, timelines: dict) -> list[tuple[int, str, dict]]:
+        """Row, signal and payload of the days of the timeline analyze would return a result for."""
+        signals, raised = [], np.zeros(len(timeline), dtype=bool)
+        for signal, (mask, payload) in self.analyze_timeline(timeline, timelines).items():
+            for loc in np.flatnonzero(mask & ~raised).tolist():
+                signals.append((loc, signal, get_payload(payload, loc)))
+            raised |= mask
+        return signals
+
+
+def get_payload(payload: dict[str, np.ndarray], loc: int) -> dict:
+    # history records hold python ints while aggregates of frames are numpy floats
+    return {key: values[loc].item() if values.dtype.kind in 'iubU' else values[loc] for key, values in payload.items()}
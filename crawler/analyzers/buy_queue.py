@@ -1,9 +1,11 @@
+import numpy as np
+
 from crawler.analytic import is_upper_buy_closed
-from crawler.analyzers.analyzer import Analyzer
+from crawler.analyzers.analyzer import PanelAnalyzer, BacktestAnalyzer
 from crawler.models import Share
 
 
-class BuyQueueAnalyzer(Analyzer):
+class BuyQueueAnalyzer(PanelAnalyzer, BacktestAnalyzer):
     def __init__(self, threshold=2):
         self.threshold = threshold
 
@@ -13,3 +15,17 @@ class BuyQueueAnalyzer(Analyzer):
 
         if is_upper_buy_closed(share.daily_history(day_offset)[-self.threshold:]):
             return {"buy queue": {"days": self.threshold}}
+
+    def analyze_market(self, market):
+        closed = market.adjusted['last'] > market.adjusted['open'] * 1.068
+        return {"buy queue": ((market.sizes >= self.threshold) &
+                              (market.count(closed, market.get_window(rows=self.threshold)) == self.threshold),
+                              {"days": np.full(len(market), self.threshold)})}
+
+    def analyze_timeline(self, timeline, timelines):
+        forward = timeline.forward
+        closed = forward['last'] > forward['open'] * 1.068
+        return {"buy queue": ((timeline.rows >= self.threshold - 1) &
+                              (timeline.count(closed, timeline.get_starts(rows=self.threshold), timeline.rows + 1) ==
+                               self.threshold),
+                              {"days": np.full(len(timeline), self.threshold)})}
@@ -1,8 +1,17 @@
-from crawler.analyzers.analyzer import Analyzer
+from crawler.analyzers.analyzer import PanelAnalyzer, BacktestAnalyzer
 from crawler.models import Share
 
 
-class CheapRightIssueAnalyzer(Analyzer):
+class CheapRightIssueAnalyzer(PanelAnalyzer, BacktestAnalyzer):
     def analyze(self, share: Share, day_offset: int):
         if share.is_rights_issue and share.last_day_history(day_offset)['close'] < 300:
             return {"cheap right issue": {"price": share.last_day_history(day_offset)['close']}}
+
+    def analyze_market(self, market):
+        close = market.last(market.raw['close'])
+        return {"cheap right issue": (market.get_flags(lambda share: share.is_rights_issue) & (close < 300),
+                                      {"price": close})}
+
+    def analyze_timeline(self, timeline, timelines):
+        close = timeline.raw['close']
+        return {"cheap right issue": (timeline.asset.is_rights_issue & (close < 300), {"price": close})}
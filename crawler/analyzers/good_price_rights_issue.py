@@ -1,4 +1,6 @@
-from crawler.analyzers.analyzer import Analyzer
+import numpy as np
+
+from crawler.analyzers.analyzer import BacktestAnalyzer
 from crawler.models import Share
 
 
@@ -8,7 +10,7 @@ from crawler.models import Share
 # import pandas as pd
 
 
-class GoodPriceRightIssueAnalyzer(Analyzer):
+class GoodPriceRightIssueAnalyzer(BacktestAnalyzer):
     def analyze(self, share: Share, day_offset: int):
         if share.is_rights_issue and share.base_share and share.base_share.history_size(day_offset) > 0:
             # df = pd.merge(share.daily_history, main_share.daily_history, left_on='Date', right_on='Date', how='inner')
@@ -26,3 +28,14 @@ class GoodPriceRightIssueAnalyzer(Analyzer):
                 return {"good price right issue": {"price": share.last_day_history(day_offset)['close'],
                                                    "base price": share.base_share.last_day_history(day_offset)[
                                                        'close']}}
+
+    def analyze_timeline(self, timeline, timelines):
+        base = timelines.get(timeline.asset.base_share_id)
+        if not timeline.asset.is_rights_issue or base is None or len(base) == 0:
+            return {}
+
+        as_of = base.get_as_of(timeline.days)
+        base_close = base.raw['close'][np.maximum(as_of, 0)]
+        close = timeline.raw['close']
+        return {"good price right issue": ((as_of >= 0) & (base_close / (close + 1000) > 1.1),
+                                           {"price": close, "base price": base_close})}
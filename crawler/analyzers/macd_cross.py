@@ -1,34 +1,50 @@
-from stockstats import StockDataFrame
+import numpy as np
 
-from crawler.analyzers.analyzer import Analyzer
+from crawler.analyzers.analyzer import BacktestAnalyzer
+from crawler.indicators import MACD
 from crawler.models import Share
 
 
-class MACDCrossAnalyzer(Analyzer):
+class MACDCrossAnalyzer(BacktestAnalyzer):
     def __init__(self, fast_period=12, slow_period=26, signal_period=9):
         self.fast_period = fast_period
         self.slow_period = slow_period
         self.signal_period = signal_period
+        self.macd = MACD(fast_period, slow_period, signal_period)
 
-    def analyze(self, share: Share, day_offset: int):
-        StockDataFrame.MACD_EMA_SHORT = self.fast_period
-        StockDataFrame.MACD_EMA_LONG = self.slow_period
-        StockDataFrame.MACD_EMA_SIGNAL = self.signal_period
+    def get_macd(self, share: Share, day_offset: int) -> tuple[np.ndarray, np.ndarray] | None:
+        """Last two MACD and signal values, from the state kept in the summary unless it is not of the day."""
+        summary = share.get_summary(day_offset)
+        state = summary.indicators.get(self.macd.name) if summary is not None else None
+        if state is None or state['date'] != summary.last_date.isoformat():
+            # prices of daily history are already adjusted to its last day
+            state = self.macd.compute(share.daily_history(day_offset).assign(scale_factor=1.0))
+        return MACD.read(state) if state is not None else None
 
+    def analyze(self, share: Share, day_offset: int):
         if share.history_size(day_offset) < 2 or share.base_share:
             return
 
-        daily_history = StockDataFrame.retype(share.daily_history(day_offset).copy())
+        if (values := self.get_macd(share, day_offset)) is None:
+            return
+        macd, macds = values
 
-        if daily_history["macd"].iloc[-1] <= daily_history["macds"].iloc[-1] and daily_history["macd"].iloc[-2] > \
-                daily_history["macds"].iloc[-2]:
+        if macd[-1] <= macds[-1] and macd[-2] > macds[-2]:
             return {"MACD": {"trend": "dec"}}
-        elif daily_history["macd"].iloc[-1] < daily_history["macds"].iloc[-1] and daily_history["macd"].iloc[-2] >= \
-                daily_history["macds"].iloc[-2]:
+        elif macd[-1] < macds[-1] and macd[-2] >= macds[-2]:
             return {"MACD": {"trend": "dec"}}
-        elif daily_history["macd"].iloc[-1] >= daily_history["macds"].iloc[-1] and daily_history["macd"].iloc[-2] < \
-                daily_history["macds"].iloc[-2]:
+        elif macd[-1] >= macds[-1] and macd[-2] < macds[-2]:
             return {"MACD": {"trend": "asc"}}
-        elif daily_history["macd"].iloc[-1] > daily_history["macds"].iloc[-1] and daily_history["macd"].iloc[-2] <= \
-                daily_history["macds"].iloc[-2]:
+        elif macd[-1] > macds[-1] and macd[-2] <= macds[-2]:
             return {"MACD": {"trend": "asc"}}
+
+    def analyze_timeline(self, timeline, timelines):
+        if timeline.asset.base_share_id or len(timeline) < 2:
+            return {}
+
+        # crosses are the same in forward units, where the series of every view is a prefix of one series
+        macd, macds = self.macd.get_series(timeline.forward['close'])
+        last, previous = macd[1:] - macds[1:], macd[:-1] - macds[:-1]
+        dec = np.append(False, ((last <= 0) & (previous > 0)) | ((last < 0) & (previous >= 0)))
+        asc = np.append(False, ((last >= 0) & (previous < 0)) | ((last > 0) & (previous <= 0)))
+        return {"MACD": (dec | asc, {"trend": np.where(dec, "dec", "asc")})}
@@ -0,0 +1,105 @@
+from datetime import date
+
+import numpy as np
+
+from crawler.history_panel import HistoryPanel
+from crawler.history_store import HistoryStore
+from crawler.models import Share
+
+
+class MarketPanel:
+    """
+    Histories of a universe of assets up to the day of an offset, taken from a history panel and adjusted the way
+    daily_history (scaler) adjusts them. Columns are flat arrays in (asset, date) order, windows over them are the
+    (start, stop) rows of each asset, so signals of the whole market are computed by array operations.
+    """
+
+    def __init__(self, assets: list, panel: HistoryPanel, day_offset: int):
+        self.assets = [asset for asset in assets if asset in panel]
+        self.asset_ids = np.array([asset.pk for asset in self.assets], dtype=np.int64)
+        self.locs: dict[int, int] = {asset.pk: loc for loc, asset in enumerate(self.assets)}
+        self.today = Share.get_today_new(day_offset)
+
+        bounds = np.array([panel.slices.get(asset.pk, (0, 0)) for asset in self.assets],
+                          dtype=np.int64).reshape(-1, 2)
+        valid = np.concatenate([[0], np.cumsum(panel.data[0] <= self.get_day(self.today))])
+        self.sizes = valid[bounds[:, 1]] - valid[bounds[:, 0]]
+        self.stops = np.cumsum(self.sizes)
+        self.starts = self.stops - self.sizes
+
+        rows = np.repeat(bounds[:, 0] - self.starts, self.sizes) + np.arange(self.stops[-1] if len(self.stops) else 0)
+        data = panel.data[:, rows]
+        self.days = data[0]
+        self.raw = dict(zip(HistoryStore.FRAME_COLUMNS, data[1:len(HistoryStore.FRAME_COLUMNS) + 1]))
+        self.scale_factors = HistoryStore.get_factors(data)[0].copy()
+        self.fill_missing_factors()
+
+        acc_diff = self.repeat(self.last(self.scale_factors)) / self.scale_factors
+        self.adjusted = {column: self.raw[column] / acc_diff for column in
+                         ['last', 'first', 'high', 'low', 'close', 'open']}
+
+    @staticmethod
+    def get_day(d: date) -> int:
+        return (d - HistoryStore.EPOCH).days
+
+    def fill_missing_factors(self):
+        """Assets with histories stored before factors were persisted get them computed like daily_history does."""
+        missing = self.reduce(np.logical_or, np.isnan(self.scale_factors), self.get_window(), False).astype(bool)
+        if not missing.any():
+            return
+
+        open_prices = self.raw['open'].astype(np.float64)
+        open_prices[open_prices == 0] = np.nan
+        ratios = np.append(np.nan, self.raw['close'][:-1]) / open_prices
+        ratios[self.starts[self.sizes > 0]] = np.nan
+        ratios[np.isnan(ratios)] = 1
+        for start, stop in zip(self.starts[missing], self.stops[missing]):
+            self.scale_factors[start:stop] = np.cumprod(ratios[start:stop])
+
+    def __contains__(self, asset) -> bool:
+        return asset.pk in self.locs
+
+    def __len__(self) -> int:
+        return len(self.assets)
+
+    def get_flags(self, predicate) -> np.ndarray:
+        """Boolean column of a predicate over the asset objects."""
+        return np.array([bool(predicate(asset)) for asset in self.assets], dtype=bool)
+
+    def repeat(self, values: np.ndarray) -> np.ndarray:
+        """Per asset values broadcast over the rows of each asset."""
+        return np.repeat(values, self.sizes)
+
+    def get_window(self, since: date | None = None, rows: int | None = None,
+                   skip_last: int = 0) -> tuple[np.ndarray, np.ndarray]:
+        """Rows of each asset dated since a day or its last rows, leaving out the last skip_last rows."""
+        starts, stops = self.starts, self.stops - np.minimum(skip_last, self.sizes)
+        if since is not None:
+            in_window = np.concatenate([[0], np.cumsum(self.days >= self.get_day(since))])
+            starts = np.maximum(starts, self.stops - (in_window[self.stops] - in_window[self.starts]))
+        if rows is not None:
+            starts = np.maximum(starts, stops - rows)
+        return starts, np.maximum(starts, stops)
+
+    @staticmethod
+    def reduce(ufunc, values: np.ndarray, window: tuple[np.ndarray, np.ndarray], empty=np.nan) -> np.ndarray:
+        """Reduction of values over the window of each asset, empty windows get the empty value."""
+        starts, stops = window
+        result = np.full(len(starts), empty, dtype=np.result_type(values, np.asarray(empty)))
+        filled = stops > starts
+        if filled.any():
+            indices = np.stack([starts[filled], stops[filled]], axis=1).ravel()
+            result[filled] = ufunc.reduceat(np.append(values, values[:1]), indices)[::2]
+        return result
+
+    @staticmethod
+    def count(mask: np.ndarray, window: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+        return MarketPanel.reduce(np.add, mask.astype(np.int64), window, 0)
+
+    def last(self, values: np.ndarray) -> np.ndarray:
+        """Value of the last row of each asset, assets without rows get the first value as a placeholder."""
+        return values[np.maximum(self.stops - 1, 0)] if len(values) else np.zeros(len(self.assets), values.dtype)
+
+    def first(self, values: np.ndarray) -> np.ndarray:
+        return values[np.minimum(self.starts, len(values) - 1)] if len(values) else np.zeros(len(self.assets),
+                                                                                               values.dtype)
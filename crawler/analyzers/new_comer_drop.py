@@ -1,9 +1,11 @@
+import numpy as np
+
 from crawler.analytic import is_upper_buy_closed, is_upper_buy_all_day
-from crawler.analyzers.analyzer import Analyzer
+from crawler.analyzers.analyzer import PanelAnalyzer, BacktestAnalyzer
 from crawler.models import Share
 
 
-class NewComerDropAnalyzer(Analyzer):
+class NewComerDropAnalyzer(PanelAnalyzer, BacktestAnalyzer):
     def __init__(self, threshold=50):
         self.threshold = threshold
 
@@ -14,3 +16,23 @@ class NewComerDropAnalyzer(Analyzer):
         if is_upper_buy_closed(share.daily_history(day_offset)[:-1]) and not is_upper_buy_all_day(
                 share.daily_history(day_offset)[-1:]):
             return {"new comer drop": {"price": share.last_day_history(day_offset)['close']}}
+
+    def analyze_market(self, market):
+        adjusted = market.adjusted
+        closed = market.count(adjusted['last'] > adjusted['open'] * 1.068, market.get_window(skip_last=1))
+        all_day = market.last(adjusted['low'] > adjusted['open'] * 1.068)
+
+        return {"new comer drop": (~market.get_flags(lambda share: share.is_special) & (market.sizes < self.threshold) &
+                                   (market.sizes > 1) & (closed == market.sizes - 1) & ~all_day,
+                                   {"price": market.last(market.raw['close'])})}
+
+    def analyze_timeline(self, timeline, timelines):
+        if timeline.asset.is_special:
+            return {}
+
+        forward = timeline.forward
+        closed = timeline.count(forward['last'] > forward['open'] * 1.068, np.zeros_like(timeline.rows),
+                                timeline.rows)
+        return {"new comer drop": ((timeline.rows + 1 < self.threshold) & (timeline.rows > 0) &
+                                   (closed == timeline.rows) & ~(forward['low'] > forward['open'] * 1.068),
+                                   {"price": timeline.raw['close']})}
@@ -1,36 +1,60 @@
 import logging
+import math
 
-import pandas as pd
+import numpy as np
 
-from crawler.analyzers.analyzer import Analyzer
+from crawler.analyzers.analyzer import BacktestAnalyzer
+from crawler.analyzers.option_chain import OptionChain
 from crawler.models import Share
 
 logger = logging.getLogger(__name__)
 
 
-class OptionAnalyzer(Analyzer):
-    def __init__(self, threshold=10):
+class OptionAnalyzer(BacktestAnalyzer):
+    def __init__(self, threshold=10, gap=0.1):
         self.threshold = threshold
+        self.gap = gap
+        self.chain: OptionChain | None = None
+        self.timelines: dict | None = None
+        self.options_by_base: dict[int, list[Share]] = {}
+
+    def prepare(self, shares: list[Share], day_offset: int):
+        self.chain = OptionChain.load(shares, day_offset)
 
     def analyze(self, share: Share, day_offset: int):
-        active_options = share.options.filter(enable=True)
-        if not active_options.exists():
-            return
-
-        for letter in ['ض', 'ط']:
-            similar_options = active_options.filter(ticker__startswith=letter)
-            for d in set(similar_options.values_list('strike_date', flat=True)):
-                options = list(similar_options.filter(strike_date=d).order_by('option_strike_price'))
-                for i in range(1, len(options) - 1):
-                    if (options[i].history_size(day_offset) == 0 or options[i + 1].history_size(day_offset) == 0 or
-                            options[i - 1].history_size(day_offset) == 0):
-                        continue
-
-                    df = pd.merge(options[i + 1].daily_history(day_offset), options[i - 1].daily_history(day_offset),
-                                  left_on='date', right_on='date', how='inner', suffixes=('_nxt', '_prv'))
-                    df = pd.merge(options[i].daily_history(day_offset), df, left_on='date', right_on='date',
-                                  how='inner')
-                    df['arbitrage'] = df['close'] / (df['close_nxt'] + df['close_prv']) * 2
-                    if df.shape[0] > 0 and abs(1 - df.iloc[-1]['arbitrage']) > 0.1 and df.iloc[-1][
-                        'date'] == Share.get_today_new(day_offset):
-                        logger.info(f'{options[i].ticker}, {df[["date", "arbitrage"]]}')
+        if self.chain is None or self.chain.day_offset != day_offset or share.pk not in self.chain.base_ids:
+            self.chain = OptionChain.load([share], day_offset)
+
+        mispriced = self.chain.get_mispriced(share, Share.get_today_new(day_offset), self.gap)
+        if mispriced:
+            logger.info(f'{share.ticker} options: {mispriced}')
+            return {"option arbitrage": mispriced}
+
+    def analyze_timeline(self, timeline, timelines):
+        # a close is its own adjusted close on the last day of a view, so the ratios of a day are the raw ones
+        if self.timelines is not timelines:
+            self.timelines, self.options_by_base = timelines, {}
+            for option in OptionChain.get_options():
+                self.options_by_base.setdefault(option.base_share_id, []).append(option)
+
+        options = self.options_by_base.get(timeline.asset.pk, [])
+        closes = np.full((len(options), len(timeline)), np.nan)
+        for row, option in enumerate(options):
+            if option.pk not in timelines:
+                continue
+
+            option_timeline = timelines[option.pk]
+            rows = option_timeline.get_as_of(timeline.days)
+            traded = (rows >= 0) & (option_timeline.days[np.maximum(rows, 0)] == timeline.days)
+            closes[row, traded] = option_timeline.raw['close'][rows[traded]]
+
+        chain = OptionChain({timeline.asset.pk}, 0, options, timeline.days, closes)
+        mispriced = np.abs(1 - chain.arbitrage) > self.gap
+        return {"option arbitrage": (mispriced.any(axis=0), {option.ticker: np.where(mispriced[row], chain.arbitrage[
+            row], np.nan) for row, option in enumerate(options)})}
+
+    def get_signals(self, timeline, timelines):
+        """The payload of a day only has its mispriced options, like analyze."""
+        return [(loc, signal, {ticker: round(float(ratio), 3) for ticker, ratio in payload.items() if
+                               not math.isnan(ratio)}) for loc, signal, payload in
+                super().get_signals(timeline, timelines)]
@@ -0,0 +1,98 @@
+from datetime import date
+
+import numpy as np
+from django.db.models import Q
+
+from crawler.analyzers.market_panel import MarketPanel
+from crawler.history_panel import HistoryPanel
+from crawler.history_store import HistoryStore
+from crawler.models import Share
+
+
+class OptionChain:
+    """
+    Enabled options of a set of base shares ordered by base share, side (call or put), strike date and strike price,
+    with their daily_history closes as of a day offset aligned on the dates any of them is traded. Rows of options
+    next to each other in a chain (same base share, side and strike date) are adjacent.
+    """
+    SIDES = ['ض', 'ط']
+
+    def __init__(self, base_ids: set[int], day_offset: int, options: list[Share], days: np.ndarray,
+                 closes: np.ndarray):
+        self.base_ids = base_ids
+        self.day_offset = day_offset
+        self.options = options
+        self.days = days
+        self.closes = closes
+
+        keys = [(option.base_share_id, option.ticker[0], option.strike_date) for option in options]
+        self.chain_ids = np.cumsum([row == 0 or keys[row] != keys[row - 1] for row in range(len(keys))],
+                                   dtype=np.int64)
+        self.rows_by_base: dict[int, list[int]] = {}
+        for row, option in enumerate(options):
+            self.rows_by_base.setdefault(option.base_share_id, []).append(row)
+        self.arbitrage = self.get_arbitrage()
+
+    @classmethod
+    def load(cls, shares: list[Share], day_offset: int) -> 'OptionChain':
+        base_ids = {share.pk for share in shares}
+        options = OptionChain.get_options(base_ids)
+
+        series = OptionChain.get_series(options, day_offset)
+        days = np.unique(np.concatenate([np.empty(0, dtype=np.int64)] + [option_days for option_days, _ in series]))
+        closes = np.full((len(options), len(days)), np.nan)
+        for row, (option_days, option_closes) in enumerate(series):
+            closes[row, np.searchsorted(days, option_days)] = option_closes
+
+        return cls(base_ids, day_offset, options, days, closes)
+
+    @staticmethod
+    def get_options(base_ids: set[int] | None = None) -> list[Share]:
+        """Enabled options of the base shares (all of them by default) in the order of a chain."""
+        options = Share.objects.filter(Q(ticker__startswith=OptionChain.SIDES[0]) | Q(
+            ticker__startswith=OptionChain.SIDES[1]), enable=True, base_share__isnull=False)
+        if base_ids is not None:
+            options = options.filter(base_share__in=base_ids)
+
+        return sorted(options, key=lambda option: (option.base_share_id, option.ticker[0], str(option.strike_date),
+                                                   option.option_strike_price is not None,
+                                                   option.option_strike_price or 0))
+
+    @staticmethod
+    def get_series(options: list[Share], day_offset: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Days and adjusted closes of each option, from the active history panel when the option is in it."""
+        market = MarketPanel(options, HistoryPanel.active, day_offset) if (
+                HistoryPanel.active is not None and options) else None
+        series = []
+        for option in options:
+            if market is not None and option in market:
+                loc = market.locs[option.pk]
+                rows = slice(market.starts[loc], market.stops[loc])
+                series.append((market.days[rows], market.adjusted['close'][rows]))
+            else:
+                df = option.daily_history(day_offset)
+                series.append((np.array([(d - HistoryStore.EPOCH).days for d in df['date']], dtype=np.int64),
+                               df['close'].to_numpy(dtype=np.float64)))
+        return series
+
+    def get_arbitrage(self) -> np.ndarray:
+        """
+        Close of each option over the mean close of its neighbor strikes in the chain, for every date all three are
+        traded and nan otherwise.
+        """
+        arbitrage = np.full(self.closes.shape, np.nan)
+        if len(self.options) > 2:
+            inner = (self.chain_ids[1:-1] == self.chain_ids[:-2]) & (self.chain_ids[1:-1] == self.chain_ids[2:])
+            arbitrage[1:-1][inner] = (self.closes[1:-1] / (self.closes[2:] + self.closes[:-2]) * 2)[inner]
+        return arbitrage
+
+    def get_mispriced(self, share: Share, day: date, gap: float = 0.1) -> dict[str, float]:
+        """Options of the share traded with their neighbors on the day, with an arbitrage ratio off 1 by the gap."""
+        day_number = (day - HistoryStore.EPOCH).days
+        col = np.searchsorted(self.days, day_number)
+        rows = self.rows_by_base.get(share.pk, [])
+        if not rows or col == len(self.days) or self.days[col] != day_number:
+            return {}
+
+        return {self.options[row].ticker: round(float(self.arbitrage[row, col]), 3) for row in rows if
+                abs(1 - self.arbitrage[row, col]) > gap}
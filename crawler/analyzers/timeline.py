@@ -0,0 +1,73 @@
+import numpy as np
+
+from crawler.history_store import HistoryStore
+
+
+class AssetTimeline:
+    """
+    Histories of one asset where every row is also the last day of the view daily_history gives as of that day, for
+    backtests. Prices are kept in forward units (price * scale_factor), the views divide them by the factor of their
+    day, so comparisons inside a view are the same and no view is sliced or adjusted per day. Windows of the views
+    are the first row of each of them.
+    """
+
+    def __init__(self, asset, array: np.ndarray):
+        self.asset = asset
+        self.days = np.asarray(array[0])
+        self.rows = np.arange(len(self.days))
+        self.raw = dict(zip(HistoryStore.FRAME_COLUMNS, np.asarray(array[1:len(HistoryStore.FRAME_COLUMNS) + 1])))
+
+        scale_factors = HistoryStore.get_factors(array)[0].copy()
+        if np.isnan(scale_factors).any():
+            # histories stored before factors were persisted, computed like daily_history does
+            open_prices = self.raw['open'].astype(np.float64)
+            open_prices[open_prices == 0] = np.nan
+            ratios = np.append(np.nan, self.raw['close'][:-1]) / open_prices
+            scale_factors = np.cumprod(np.where(np.isnan(ratios), 1, ratios))
+        self.scale_factors = scale_factors
+        self.forward = {column: self.raw[column] * scale_factors for column in
+                        ['last', 'first', 'high', 'low', 'close', 'open']}
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def get_starts(self, days: int | None = None, rows: int | None = None) -> np.ndarray:
+        """First row of the window of each view: rows dated at most days before its day and its last rows."""
+        starts = np.zeros(len(self), dtype=np.int64)
+        if days is not None:
+            starts = np.searchsorted(self.days, self.days - days, side='left')
+        if rows is not None:
+            starts = np.maximum(starts, self.rows - rows + 1)
+        return starts
+
+    @staticmethod
+    def reduce(ufunc, values: np.ndarray, starts: np.ndarray, stops: np.ndarray, empty=np.nan) -> np.ndarray:
+        """Reduction of values over the [start, stop) rows of each view, empty windows get the empty value."""
+        result = np.full(len(starts), empty, dtype=np.result_type(values, np.asarray(empty)))
+        filled = stops > starts
+        if filled.any():
+            indices = np.stack([starts[filled], stops[filled]], axis=1).ravel()
+            result[filled] = ufunc.reduceat(np.append(values, values[:1]), indices)[::2]
+        return result
+
+    def reduce_window(self, ufunc, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """Reduction of values over the window of each view, up to and including its day."""
+        return AssetTimeline.reduce(ufunc, values, starts, self.rows + 1)
+
+    @staticmethod
+    def count(mask: np.ndarray, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+        """Number of true values in the [start, stop) rows of each view."""
+        counts = np.append(0, np.cumsum(mask))
+        return counts[stops] - counts[starts]
+
+    def count_equal(self, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """Number of rows in the window of each view whose value equals the value of its day."""
+        counts = np.zeros(len(self), dtype=np.int64)
+        for lag in range(int(np.max(self.rows - starts, initial=-1)) + 1):
+            lagged = self.rows - lag
+            counts += (lagged >= starts) & (values[np.maximum(lagged, 0)] == values)
+        return counts
+
+    def get_as_of(self, days: np.ndarray) -> np.ndarray:
+        """Row of the last day up to each of the days, -1 before the first one."""
+        return np.searchsorted(self.days, days, side='right') - 1
@@ -1,8 +1,10 @@
-from crawler.analyzers.analyzer import Analyzer
+import numpy as np
+
+from crawler.analyzers.analyzer import PanelAnalyzer, BacktestAnalyzer
 from crawler.models import Share
 
 
-class VolumeAnalyzer(Analyzer):
+class VolumeAnalyzer(PanelAnalyzer, BacktestAnalyzer):
     def __init__(self, threshold=10):
         self.threshold = threshold
 
@@ -16,3 +18,27 @@ class VolumeAnalyzer(Analyzer):
 
         if last_month_volume * 2 < last_day_volume and share.last_day_history(day_offset)['value'] > 1_000_000_000:
             return {"high volume": {"last_month_volume": last_month_volume, "last_day_volume": last_day_volume}}
+
+    def analyze_market(self, market):
+        skipped = market.get_flags(lambda share: share.base_share_id and not (
+                share.is_sell_option or share.is_buy_option or share.is_rights_issue))
+        last_month_volume = market.reduce(np.add, market.raw['volume'].astype(np.float64),
+                                          market.get_window(rows=self.threshold, skip_last=1)) / self.threshold
+        last_day_volume = market.last(market.raw['volume'])
+
+        return {"high volume": ((market.sizes >= self.threshold + 1) & ~skipped &
+                                (last_month_volume * 2 < last_day_volume) &
+                                (market.last(market.raw['value']) > 1_000_000_000),
+                                {"last_month_volume": last_month_volume, "last_day_volume": last_day_volume})}
+
+    def analyze_timeline(self, timeline, timelines):
+        share = timeline.asset
+        if share.base_share_id and not (share.is_sell_option or share.is_buy_option or share.is_rights_issue):
+            return {}
+
+        volume = timeline.raw['volume']
+        last_month_volume = timeline.reduce(np.add, volume.astype(np.float64),
+                                            timeline.get_starts(rows=self.threshold + 1), timeline.rows) / self.threshold
+        return {"high volume": ((timeline.rows >= self.threshold) & (last_month_volume * 2 < volume) &
+                                (timeline.raw['value'] > 1_000_000_000),
+                                {"last_month_volume": last_month_volume, "last_day_volume": volume})}
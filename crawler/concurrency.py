@@ -0,0 +1,52 @@
+import logging
+import time
+
+from crawler.http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrency:
+    """AIMD controller for the number of running jobs, driven by the latency and throttling seen by http_client."""
+
+    def __init__(self, initial: int = 10, minimum: int = 2, maximum: int = 64, interval: float = 5,
+                 throttle_ratio: float = 0.05, latency_ratio: float = 2):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = interval
+        self.throttle_ratio = throttle_ratio
+        self.latency_ratio = latency_ratio
+
+        self.base_latency: float | None = None
+        self.throughput: float = 0
+        self.completed: int = 0
+        self.started_at: float = time.time()
+        self.snapshot: tuple[int, int, float] = http_client.snapshot()
+
+    def on_complete(self):
+        self.completed += 1
+        elapsed = time.time() - self.started_at
+        if elapsed < self.interval:
+            return
+
+        requests, throttles, latency = http_client.snapshot()
+        requests, throttles, latency = (requests - self.snapshot[0], throttles - self.snapshot[1],
+                                        latency - self.snapshot[2])
+        self.throughput = round(self.completed / elapsed, 2)
+
+        if requests:
+            average_latency = latency / requests
+            self.base_latency = min(self.base_latency or average_latency, average_latency)
+
+            if throttles / requests > self.throttle_ratio:
+                self.limit = max(self.minimum, self.limit // 2)
+            elif average_latency > self.base_latency * self.latency_ratio:
+                self.limit = max(self.minimum, self.limit - 1)
+            else:
+                self.limit = min(self.maximum, self.limit + 1)
+
+        self.completed, self.started_at, self.snapshot = 0, time.time(), http_client.snapshot()
+
+    def __str__(self):
+        return f"concurrency {self.limit}, {self.throughput} jobs/s"
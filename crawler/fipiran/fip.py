@@ -1,4 +1,4 @@
-import requests
+from crawler.http_client import http_client
 
 headers = {
     'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:76.0) Gecko/20100101 Firefox/76.0',
@@ -15,8 +15,8 @@ headers = {
 
 
 def search(share):
-    response = requests.post('http://www.fipiran.com/DataService/AutoCompletefund', headers=headers,
-                             data={'id': share.ticker})
+    response = http_client.post('http://www.fipiran.com/DataService/AutoCompletefund', headers=headers,
+                                data={'id': share.ticker})
 
     return response.json()
 
@@ -34,6 +34,6 @@ def download_nav_history():
         'Upgrade-Insecure-Requests': '1',
     }
 
-    response = requests.post('http://www.fipiran.com/DataService/ExportMF', headers=headers,
-                             data={"RegNoN": "11308", "MFStart": "1394/01/01", "MFEnd": "1399/01/01"})
+    response = http_client.post('http://www.fipiran.com/DataService/ExportMF', headers=headers,
+                                data={"RegNoN": "11308", "MFStart": "1394/01/01", "MFEnd": "1399/01/01"})
     return response.text
@@ -1,27 +1,37 @@
+import asyncio
 import concurrent
+import hashlib
+import itertools
 import json
 import logging
-import math
 import typing
 from asyncio import CancelledError
 from datetime import datetime, date, timedelta
 from io import StringIO
 
-import numpy as np
+import aiohttp
 import pandas as pd
-import requests
 import urllib3
+from asgiref.sync import sync_to_async
 from bs4 import BeautifulSoup
+from django.db.models import Max
 from django.utils import timezone
 from django.utils.timezone import make_aware
 from getuseragent import UserAgent
 from persiantools import characters
-from tenacity import _utils, retry_if_not_exception_type
-from tenacity import stop_after_attempt, wait_random_exponential, retry, RetryCallState
+from tenacity import _utils, retry_if_not_exception_type, retry_base
+from tenacity import wait_random_exponential, retry, RetryCallState
+from tenacity.stop import stop_base
+from tenacity.wait import wait_base
 
+from crawler.concurrency import AdaptiveConcurrency
 from crawler.decorators import log_time
-from crawler.models import Share, DailyHistory, ShareGroup, Contract
-from crawler.time_helper import convert_integer_to_parts
+from crawler.history_cache import history_cache
+from crawler.history_panel import HistoryPanel
+from crawler.history_store import history_store, HistoryStore
+from crawler.http_client import http_client, CircuitOpenError
+from crawler.models import Share, DailyHistory, ShareGroup, Contract, ShareIndex, AssetSummary
+from crawler.time_helper import convert_integer_to_parts, get_last_session_date, count_trading_days
 
 logger = logging.getLogger(__name__)
 user_agent = UserAgent()
@@ -67,7 +77,7 @@ def after_log(
         else:
             fn_name = _utils.get_callback_name(retry_state.fn)
             args, kwargs = list(retry_state.args), dict(retry_state.kwargs)
-            for key in {'headers', 'timeout'}:
+            for key in {'headers', 'timeout', 'session'}:
                 if key in kwargs:
                     del kwargs[key]
 
@@ -81,14 +91,77 @@ def after_log(
     return log_it
 
 
-@retry(reraise=True, stop=stop_after_attempt(6), wait=wait_random_exponential(multiplier=1, max=60),
-       after=after_log(logger, logging.DEBUG),
-       retry=retry_if_not_exception_type(CancelledError) & retry_if_not_exception_type(KeyboardInterrupt))
+class retry_if_retry_budget_allows(retry_base):
+    """Retry strategy that spends a token of the retry budget shared by all jobs."""
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        return http_client.retry_budget.withdraw()
+
+
+class retry_if_circuit_recovers(retry_base):
+    """Retry strategy for calls refused by an open circuit that may still wait for its probe."""
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        exception = retry_state.outcome.exception()
+        return isinstance(exception, CircuitOpenError) and exception.retry_after is not None
+
+
+class wait_for_circuit(wait_base):
+    """Wait strategy that waits for the probe of an open circuit and falls back to another one for failed requests."""
+
+    def __init__(self, fallback: wait_base):
+        self.fallback = fallback
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        exception = retry_state.outcome.exception()
+        if isinstance(exception, CircuitOpenError):
+            return exception.retry_after
+        return self.fallback(retry_state)
+
+
+class stop_after_failed_requests(stop_base):
+    """
+    Stop strategy counting only the requests that failed, calls refused by an open circuit stop waiting for it after
+    max_circuit_wait seconds.
+    """
+
+    def __init__(self, max_attempts: int, max_circuit_wait: float):
+        self.max_attempts = max_attempts
+        self.max_circuit_wait = max_circuit_wait
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        if isinstance(retry_state.outcome.exception(), CircuitOpenError):
+            return retry_state.seconds_since_start >= self.max_circuit_wait
+
+        retry_state.failed_requests = getattr(retry_state, 'failed_requests', 0) + 1
+        return retry_state.failed_requests >= self.max_attempts
+
+
+def record_retry(retry_state: RetryCallState) -> None:
+    if not isinstance(retry_state.outcome.exception(), CircuitOpenError):
+        http_client.record_retry(retry_state.kwargs['url'] if 'url' in retry_state.kwargs else retry_state.args[1])
+
+
+# calls refused by an open circuit wait once for its probe without spending the retry budget, and fail fast once
+# the probe fails
+REQUEST_RETRY = dict(reraise=True, stop=stop_after_failed_requests(6, max_circuit_wait=60),
+                     wait=wait_for_circuit(wait_random_exponential(multiplier=1, max=60)),
+                     after=after_log(logger, logging.DEBUG), before_sleep=record_retry,
+                     retry=retry_if_not_exception_type(CancelledError) &
+                           retry_if_not_exception_type(KeyboardInterrupt) &
+                           (retry_if_circuit_recovers() | (retry_if_not_exception_type(CircuitOpenError) &
+                                                           retry_if_retry_budget_allows())))
+
+
+@retry(**REQUEST_RETRY)
 def submit_request(method: str, url: str, params: tuple = tuple(), headers: dict | None = None,
                    data: dict | None = None, retry_on_empty_response: bool = False,
-                   retry_on_html_response: bool = False, timeout: int = 5):
-    response = getattr(requests, method.lower())(url, params=params, headers=headers, json=data, timeout=timeout,
-                                                 verify=False)
+                   retry_on_html_response: bool = False, timeout: int = 5, conditional: bool = False):
+    response = http_client.request(method, url, params=params, headers=headers, json=data, timeout=timeout,
+                                   verify=False, conditional=conditional)
+
+    if conditional and response.status_code == 304:
+        return response
 
     if response.status_code != 200:
         raise Exception(f"Http Error: {response.status_code}, {url.split('/')[-1]}, {params}")
@@ -102,30 +175,113 @@ def submit_request(method: str, url: str, params: tuple = tuple(), headers: dict
     return response
 
 
+@retry(**REQUEST_RETRY)
+async def async_submit_request(method: str, url: str, session: aiohttp.ClientSession, params: tuple = tuple(),
+                               headers: dict | None = None, data: dict | None = None,
+                               retry_on_empty_response: bool = False, retry_on_html_response: bool = False,
+                               timeout: int = 5) -> str:
+    status_code, text = await http_client.async_request(session, method, url, params=params, headers=headers,
+                                                        json=data, timeout=timeout)
+
+    if status_code != 200:
+        raise Exception(f"Http Error: {status_code}, {url.split('/')[-1]}, {params}")
+
+    if retry_on_empty_response and len(text.strip()) == 0:
+        raise Exception(f"Http Error: empty response, {url.split('/')[-1]}, {params}")
+
+    if retry_on_html_response and ('<html>' in text or '<!doctype html>' in text):
+        raise Exception(f"Http Error: html response, {url.split('/')[-1]}, {params}")
+
+    return text
+
+
 @log_time
-def run_jobs(job_title, jobs, max_workers=10, log=True, log_exception_on_failure=True):
+def run_jobs(job_title, jobs, max_workers=10, log=True, log_exception_on_failure=True, adaptive=False):
     number_of_buckets = max(min(20, len(jobs) // 10), 2)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
-        futures = [pool.submit(job) for job in jobs]
+    controller = AdaptiveConcurrency(initial=max_workers) if adaptive else None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=controller.maximum if adaptive else max_workers) as pool:
+        pending_jobs, running = iter(jobs), set()
+
+        def submit_jobs():
+            while not adaptive or len(running) < controller.limit:
+                job = next(pending_jobs, None)
+                if job is None:
+                    break
+                running.add(pool.submit(job))
+
+        submit_jobs()
+
+        success, error, index, results = 0, 0, -1, []
+        while running:
+            done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                index += 1
+                if future.exception():
+                    error += 1
+                    if log:
+                        if log_exception_on_failure:
+                            logger.exception(f'{job_title}: job crashed!', exc_info=future.exception())
+                        else:
+                            logger.warning(f'{job_title}: job crashed!', exc_info=future.exception())
+                else:
+                    success += 1
+                    results.append(future.result())
+
+                if adaptive:
+                    controller.on_complete()
 
-        success, error = 0, 0
-        for index, future in enumerate(concurrent.futures.as_completed(futures)):
-            if future.exception():
-                error += 1
                 if log:
-                    if log_exception_on_failure:
-                        logger.exception(f'{job_title}: job crashed!', exc_info=future.exception())
-                    else:
-                        logger.warning(f'{job_title}: job crashed!', exc_info=future.exception())
-            else:
-                success += 1
+                    if int((index + 1) * number_of_buckets / len(jobs)) - int(index * number_of_buckets / len(jobs)):
+                        percent = round((index + 1) / len(jobs) * 100, 2)
+                        logger.info(f"{job_title}: {success}/{index + 1} out of {len(jobs)}({percent}%)" +
+                                    (f", {controller}" if adaptive else ""))
+
+            submit_jobs()
+
+        logger.info(f"Task {job_title}: {success} tasks completed out of {len(jobs)}" +
+                    (f", settled on {controller}" if adaptive else ""))
+
+    return results
+
 
-            if log:
-                if int((index + 1) * number_of_buckets / len(futures)) - int(index * number_of_buckets / len(futures)):
-                    percent = round((index + 1) / len(futures) * 100, 2)
-                    logger.info(f"{job_title}: {success}/{index + 1} out of {len(futures)}({percent}%)")
+@log_time
+def run_async_jobs(job_title, jobs, concurrency=50, log=True, log_exception_on_failure=True):
+    """Async counterpart of run_jobs, each job is called with a shared pooled aiohttp session."""
+    number_of_buckets = max(min(20, len(jobs) // 10), 2)
 
-        logger.info(f"Task {job_title}: {success} tasks completed out of {len(futures)}")
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        connector = aiohttp.TCPConnector(limit=concurrency, ssl=False, ttl_dns_cache=5 * 60)
+
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async def run_job(job):
+                async with semaphore:
+                    return await job(session=session)
+
+            tasks = [asyncio.ensure_future(run_job(job)) for job in jobs]
+
+            success, error, results = 0, 0, []
+            for index, task in enumerate(asyncio.as_completed(tasks)):
+                try:
+                    results.append(await task)
+                    success += 1
+                except Exception as e:
+                    error += 1
+                    if log:
+                        if log_exception_on_failure:
+                            logger.exception(f'{job_title}: job crashed!', exc_info=e)
+                        else:
+                            logger.warning(f'{job_title}: job crashed!', exc_info=e)
+
+                if log:
+                    if int((index + 1) * number_of_buckets / len(tasks)) - int(index * number_of_buckets / len(tasks)):
+                        percent = round((index + 1) / len(tasks) * 100, 2)
+                        logger.info(f"{job_title}: {success}/{index + 1} out of {len(tasks)}({percent}%)")
+
+            logger.info(f"Task {job_title}: {success} tasks completed out of {len(tasks)}")
+            return results
+
+    return asyncio.run(run_all())
 
 
 @log_time
@@ -135,7 +291,7 @@ def update_share_list_by_group(group):
         ('t', 'g'),
         ('s', '0'),
     )
-    response = requests.get('http://old.tsetmc.com/tsev2/data/InstValue.aspx', params=params, timeout=10)
+    response = http_client.get('http://old.tsetmc.com/tsev2/data/InstValue.aspx', params=params, timeout=10)
 
     if response.status_code != 200:
         raise Exception(f"Http Error: {response.status_code}")
@@ -145,7 +301,7 @@ def update_share_list_by_group(group):
 
 @log_time
 def update_share_groups():
-    response = requests.get('https://cdn.tsetmc.com/api/StaticData/GetStaticData', headers=get_tse_new_site_headers())
+    response = http_client.get('https://cdn.tsetmc.com/api/StaticData/GetStaticData', headers=get_tse_new_site_headers())
     response.raise_for_status()
 
     for item in response.json()['staticData']:
@@ -165,38 +321,61 @@ def update_share_groups():
     logger.info(f"Share group info updated. number of groups: {ShareGroup.objects.count()}")
 
 
-def update_share_identity(share: Share):
+def commit_share(share: Share, validator_key: str | None, save: bool) -> Share:
+    """Saves a share changed by a conditional response, unsaved shares carry its validator for their caller."""
+    if save:
+        share.save()
+        http_client.commit_validators([validator_key])
+    else:
+        share.validator_key = validator_key
+    return share
+
+
+def update_share_identity(share: Share, save: bool = True) -> Share | None:
     response = submit_request(method='get',
                               url=f'https://cdn.tsetmc.com/api/Instrument/GetInstrumentIdentity/{share.id}',
-                              headers=get_tse_new_site_headers(), retry_on_html_response=True, timeout=25).json()[
-        'instrumentIdentity']
+                              headers=get_tse_new_site_headers(), retry_on_html_response=True, timeout=25,
+                              conditional=True)
+    if response.status_code == 304:
+        return
+
+    content_hash, validator_key = hashlib.sha256(response.content).hexdigest(), response.validator_key
+    if share.identity and share.identity_hash == content_hash:
+        http_client.commit_validators([validator_key])
+        return
 
     try:
-        response = json.loads(characters.ar_to_fa(json.dumps(response)))
+        response = json.loads(characters.ar_to_fa(json.dumps(response.json()['instrumentIdentity'])))
 
-        if share.identity:
-            if share.identity != response:
-                logger.warning(f'{share.ticker}: detailed info changed from {share.identity} to {response}')
-            else:
-                return
+        if share.identity and share.identity != response:
+            logger.warning(f'{share.ticker}: detailed info changed from {share.identity} to {response}')
 
         share.identity = response
+        share.identity_hash = content_hash
         if share.group_id:
             assert share.group_id == int(share.identity['sector']['cSecVal'].strip())
         assert share.isin == share.identity['instrumentID']
-        share.save()
+        return commit_share(share, validator_key, save)
     except:
+        http_client.drop_validator(validator_key)
         logger.exception(f'{share.ticker} update share detailed info failed {response}!!')
         raise
 
 
+def search_instruments(keyword) -> list[dict]:
+    return submit_request(method='get',
+                          url=f'https://cdn.tsetmc.com/api/Instrument/GetInstrumentSearch/{keyword}',
+                          headers=get_tse_new_site_headers(), retry_on_html_response=True, timeout=25).json()[
+        'instrumentSearch']
+
+
 def search_share(keyword):
-    response = submit_request(method='get',
-                              url=f'https://cdn.tsetmc.com/api/Instrument/GetInstrumentSearch/{keyword}',
-                              headers=get_tse_new_site_headers(), retry_on_html_response=True, timeout=25)
+    save_search_result(keyword, search_instruments(keyword))
 
+
+def save_search_result(keyword, rows: list[dict]):
     new_list, update_list = [], []
-    for row in response.json()['instrumentSearch']:
+    for row in rows:
         data = {
             'id': int(row['insCode']),
             'ticker': characters.ar_to_fa(str(row['lVal18AFC'])).strip(),
@@ -226,23 +405,146 @@ def search_share(keyword):
             else:
                 new_list.append(Share(**data))
 
-    Share.objects.bulk_create(new_list, batch_size=100)
+    Share.objects.bulk_create(new_list, batch_size=100, ignore_conflicts=True)
     Share.objects.bulk_update(update_list, ['ticker', 'description', 'bazaar_type', 'enable', 'option_strike_price',
                                             'strike_date', 'base_share'], batch_size=100)
     if new_list or update_list:
         logger.info(f"update share list {keyword}, {len(new_list)} added ({new_list}), {len(update_list)} updated.")
 
 
-def update_share_history_item(share, last_update: bool = True, days=None, batch_size=100):
+def get_stored_dates(asset, histories: list[DailyHistory]) -> set[date]:
+    if not histories:
+        return set()
+
+    return set(asset.history.filter(date__gte=min(history.date for history in histories)).values_list('date',
+                                                                                                      flat=True))
+
+
+def get_history_checksum(values) -> str:
+    return hashlib.sha1(json.dumps([int(value) for value in values]).encode()).hexdigest()
+
+
+def split_revised_histories(asset, histories: list[DailyHistory]) -> tuple[list[DailyHistory], list[DailyHistory]]:
+    """Splits fetched histories into new ones and the stored ones upstream has revised, compared by checksum."""
+    if not histories:
+        return [], []
+
+    dates = [history.date for history in histories]
+    checksums = {row[0]: get_history_checksum(row[1:]) for row in asset.history.filter(
+        date__gte=min(dates), date__lte=max(dates)).values_list('date', *HistoryStore.COLUMNS)}
+
+    new = [history for history in histories if history.date not in checksums]
+    revised = [history for history in histories if history.date in checksums and checksums[history.date] !=
+               get_history_checksum(getattr(history, column) for column in HistoryStore.COLUMNS)]
+    return new, revised
+
+
+def get_share_history_url(share, days=None, revision_days: int = 0):
+    # recorded histories are whole, so a capture replays into any database state
+    if http_client.response_store.enabled:
+        days = 0
     if days is None:
         days = (timezone.now() - share.last_update).days + 1 if share.last_update else 0
+    if days and revision_days:
+        days = max(days, revision_days)
+
+    return f'https://cdn.tsetmc.com/api/ClosingPrice/GetClosingPriceDailyList/{share.id}/{days}'
+
+
+def get_last_history_dates(model) -> dict[int, date]:
+    """Last stored history date of every asset of the model, by one aggregated query."""
+    field = model._meta.get_field('history').field.name
+    return dict(DailyHistory.objects.filter(**{f'{field}__isnull': False}).values_list(field).annotate(Max('date')))
+
+
+def can_have_new_history(share, last_session: date) -> bool:
+    """Disabled shares and options fetched since their expiry get no new histories."""
+    if not share.enable:
+        return False
+    return not (share.strike_date and share.strike_date < last_session and share.last_update and
+                timezone.localtime(share.last_update).date() > share.strike_date)
 
-    response = submit_request(method='get',
-                              url=f'https://cdn.tsetmc.com/api/ClosingPrice/GetClosingPriceDailyList/{share.id}/{days}',
-                              headers=get_tse_new_site_headers(), retry_on_html_response=True, timeout=25)
 
+def plan_share_history(shares: list[Share], revision_days: int = 0) -> list[tuple[Share, int]]:
+    """
+    Shares to fetch with the number of trading days missing after their last stored history (0 for the whole
+    history), shares already holding the last session are left out unless histories are being revised. While
+    responses are recorded or replayed every share is fetched whole.
+    """
+    last_session = get_last_session_date()
+    last_dates = get_last_history_dates(Share)
+    plan = []
+    for share in shares:
+        if not can_have_new_history(share, last_session):
+            continue
+
+        last_date = last_dates.get(share.id)
+        if last_date is None or http_client.response_store.enabled:
+            days = 0
+        elif last_date < last_session:
+            days = count_trading_days(last_date, last_session) + 1
+        elif revision_days:
+            days = revision_days
+        else:
+            continue
+        plan.append((share, days))
+
+    return plan
+
+
+def plan_contract_history(contracts: list[Contract], revision_days: int = 0) -> list[tuple[Contract, int | None]]:
+    """
+    Contracts to fetch with the number of days missing after their last stored history, all of them whole while
+    responses are recorded or replayed.
+    """
+    last_session = get_last_session_date()
+    last_dates = get_last_history_dates(Contract)
+    plan = []
+    for contract in contracts:
+        last_date = last_dates.get(contract.id)
+        if last_date is None or http_client.response_store.enabled:
+            plan.append((contract, None))
+        elif last_date < last_session or revision_days:
+            plan.append((contract, max((date.today() - last_date).days - 1, 0)))
+
+    return plan
+
+
+def on_history_added(asset, histories: list[DailyHistory], appended: bool = True):
+    """Keeps the derived read paths of an asset in sync with its newly stored histories."""
+    history_cache.invalidate(asset)
+    HistoryPanel.invalidate(asset)
+    AssetSummary.update_asset(asset, histories, appended)
+    if history_store.enabled:
+        history_store.append(asset, histories) if appended else history_store.rebuild(asset)
+
+
+def store_histories(asset, histories: list[DailyHistory], batch_size: int = 100,
+                    revised: list[DailyHistory] | None = None):
+    """Stores new histories of an asset with their adjustment factors, revised histories are upserted."""
+    if not histories and not revised:
+        return
+
+    histories = sorted(histories, key=lambda history: history.date)
+    appended = (not revised and not asset.history.filter(date__gt=histories[0].date).exists() and
+                asset.set_adjustment_factors(histories))
+    DailyHistory.objects.bulk_create(histories, batch_size=batch_size)
+    if revised:
+        DailyHistory.objects.bulk_create(revised, batch_size=batch_size, update_conflicts=True,
+                                         unique_fields=[asset._meta.get_field('history').field.name, 'date'],
+                                         update_fields=HistoryStore.COLUMNS)
+        histories = sorted(histories + revised, key=lambda history: history.date)
+
+    if not appended:
+        asset.update_adjustment_factors(histories[0].date, batch_size)
+
+    on_history_added(asset, histories, appended)
+
+
+def save_share_history(share, response: dict, last_update: bool = True, batch_size=100, writer=None,
+                       revision_days: int = 0) -> tuple[int, int]:
     share_histories = []
-    for row in response.json()['closingPriceDaily']:
+    for row in response['closingPriceDaily']:
         data = {'share': share,
                 'date': date(*convert_integer_to_parts(row['dEven'])),
                 'high': row['priceMax'],
@@ -258,19 +560,54 @@ def update_share_history_item(share, last_update: bool = True, days=None, batch_
         if data['count'] == 0:
             continue
 
-        if DailyHistory.objects.filter(share=share, date=data['date']).exists():
-            break
-
         share_histories.append(DailyHistory(**data))
 
+    if revision_days:
+        share_histories, revised = split_revised_histories(share, share_histories)
+    else:
+        stored_dates = get_stored_dates(share, share_histories)
+        share_histories = list(itertools.takewhile(lambda history: history.date not in stored_dates,
+                                                   share_histories))
+        revised = []
+
     share.last_update = timezone.now()
 
-    DailyHistory.objects.bulk_create(share_histories, batch_size=batch_size)
+    if writer is not None:
+        writer.submit(share, share_histories, revised)
+    else:
+        store_histories(share, share_histories, batch_size, revised)
     if last_update:
         share.save()
 
     if share_histories:
         logger.info(f"history of {share.ticker} in {len(share_histories)} days added.")
+    if revised:
+        logger.info(f"history of {share.ticker} in {len(revised)} days revised.")
+
+    return len(share_histories), len(revised)
+
+
+def update_share_history_item(share, last_update: bool = True, days=None, batch_size=100, writer=None,
+                              revision_days: int = 0) -> tuple[int, int]:
+    response = submit_request(method='get', url=get_share_history_url(share, days, revision_days),
+                              headers=get_tse_new_site_headers(), retry_on_html_response=True, timeout=25)
+
+    return save_share_history(share, response.json(), last_update, batch_size, writer, revision_days)
+
+
+async def async_update_share_history_item(share, session: aiohttp.ClientSession, last_update: bool = True,
+                                          days=None, batch_size=100, writer=None,
+                                          revision_days: int = 0) -> tuple[int, int]:
+    text = await async_submit_request(method='get', url=get_share_history_url(share, days, revision_days),
+                                      session=session, headers=get_tse_new_site_headers(),
+                                      retry_on_html_response=True, timeout=25)
+
+    return await sync_to_async(save_share_history)(share, json.loads(text), last_update, batch_size, writer,
+                                                   revision_days)
+
+
+def get_column(df: pd.DataFrame, column: int) -> list:
+    return df[column].astype(object).where(df[column].notna(), None).tolist()
 
 
 @log_time
@@ -278,30 +615,42 @@ def update_share_list(batch_size=100):
     text = get_watch_list(h=0, r=0)
 
     df = pd.read_csv(StringIO(text.split("@")[2]), sep=',', lineterminator=';', header=None)
-    df = df.replace({np.nan: None})
 
-    new_list, update_list = [], []
-    for index, row in df.iterrows():
-        try:
-            share = Share.objects.get(id=row[0])
-        except Share.DoesNotExist:
-            share = Share()
+    shares: dict[int, Share] = Share.objects.in_bulk()
+    groups: dict[int, ShareGroup] = ShareGroup.objects.in_bulk()
+    index = ShareIndex(shares.values())
 
+    # rows without a ticker or description are skipped, instead of being written as 'nan'
+    skipped = df[df[2].isna() | df[3].isna()]
+    if len(skipped):
+        logger.warning(f"{len(skipped)} shares without ticker or description skipped: {skipped[0].tolist()}")
+    df = df.dropna(subset=[2, 3])
+
+    tickers = df[2].astype(str).map(characters.ar_to_fa).str.strip().tolist()
+    descriptions = df[3].astype(str).map(characters.ar_to_fa).str.strip().tolist()
+    eps = pd.to_numeric(df[14], errors='coerce')
+    eps = eps.astype(object).where(eps.notna() & (eps != 0), None).tolist()
+
+    new_list, update_list = [], []
+    for share_id, ticker, description, share_eps, base_volume, bazaar_type, group_id, total_count, bazaar_group in zip(
+            df[0].tolist(), tickers, descriptions, eps, get_column(df, 15), get_column(df, 17),
+            get_column(df, 18), get_column(df, 21), get_column(df, 22)):
+        share = shares.get(share_id, Share())
         try:
             share.enable = True
-            share.ticker = characters.ar_to_fa(str(row[2])).strip()
-            share.description = characters.ar_to_fa(row[3]).strip()
-            share.eps = row[14] if row[14] and row[14] != 'nan' and not math.isnan(row[14]) else None
-            share.base_volume = row[15]
-            share.bazaar_type = row[17]
-            share.group = ShareGroup.objects.get(id=row[18])
-            share.total_count = row[21]
-            share.bazaar_group = row[22]
-            share.strike_date, share.option_strike_price, share.base_share = share.parse_data()
+            share.ticker = ticker
+            share.description = description
+            share.eps = share_eps
+            share.base_volume = base_volume
+            share.bazaar_type = bazaar_type
+            share.group = groups[group_id]
+            share.total_count = total_count
+            share.bazaar_group = bazaar_group
+            share.strike_date, share.option_strike_price, share.base_share = share.parse_data(index)
             (update_list if share.id else new_list).append(share)
-            share.id = row[0]
+            share.id = share_id
         except:
-            logger.warning(f'{share.ticker} parse share data failed! {row}!!')
+            logger.warning(f'{share.ticker} parse share data failed! {share_id}!!')
 
     Share.objects.bulk_create(new_list, batch_size=batch_size)
     Share.objects.bulk_update(update_list,
@@ -334,9 +683,16 @@ def get_watch_list(h='0', r='0'):
     return response.text
 
 
-def get_share_detailed_info(share):
-    response = requests.get('http://old.tsetmc.com/Loader.aspx', headers=get_headers(share),
-                            params=(('Partree', '15131M'), ('i', share.id),), timeout=10)
+def get_share_detailed_info(share, save: bool = True) -> Share | None:
+    response = http_client.get('http://old.tsetmc.com/Loader.aspx', headers=get_headers(share),
+                               params=(('Partree', '15131M'), ('i', share.id),), timeout=10, conditional=True)
+    if response.status_code == 304:
+        return
+
+    content_hash, validator_key = hashlib.sha256(response.content).hexdigest(), response.validator_key
+    if share.extra_data and share.extra_data_hash == content_hash:
+        http_client.commit_validators([validator_key])
+        return
 
     data = {}
     for row in BeautifulSoup(response.text, features='html.parser').body.select('tr'):
@@ -348,21 +704,21 @@ def get_share_detailed_info(share):
         data[key] = value
 
     if not data or 'کد گروه صنعت' not in data or 'کد 12 رقمی نماد' not in data:
+        http_client.drop_validator(validator_key)
         return
 
     try:
         data = json.loads(characters.ar_to_fa(json.dumps(data)))
-        if share.extra_data:
-            if share.extra_data != data:
-                logger.warning(f'{share.ticker}: detailed info changed from {share.extra_data} to {data}')
-            else:
-                return
+        if share.extra_data and share.extra_data != data:
+            logger.warning(f'{share.ticker}: detailed info changed from {share.extra_data} to {data}')
 
         share.extra_data = data
+        share.extra_data_hash = content_hash
         share.group = ShareGroup.objects.get(id=data['کد گروه صنعت'])
         share.isin = data['کد 12 رقمی نماد']
-        share.save()
+        return commit_share(share, validator_key, save)
     except:
+        http_client.drop_validator(validator_key)
         logger.exception(f'{share.ticker} update share detailed info failed {data}!!')
         raise
 
@@ -395,52 +751,93 @@ def update_contract_list(batch_size: int = 100):
     logger.info(f"update contract list, {len(new_list)} ({new_list}) added, {len(update_list)} updated.")
 
 
-def update_contract_history_item(contract, days: int | None = None, batch_size: int = 100):
-    if days is None:
+def get_contract_history(contract, from_date: date, to_date: date, page_size: int = 90) -> list[dict]:
+    return submit_request(method='post',
+                          url='https://dataapi.ime.co.ir/api/CDC/CDCTrades',
+                          data={"fromDate": str(from_date),
+                                "toDate": str(to_date),
+                                "pageNumber": 1,
+                                "pageSize": page_size,
+                                "marketId": 22,
+                                "customFilter": str(contract.commodity_id)},
+                          headers={'User-Agent': user_agent.Random()},
+                          timeout=30).json()['Data']
+
+
+def get_contract_history_windows(days: int, window_size: int = 90) -> list[tuple[date, date]]:
+    """Windows of at most window_size days covering the last days before today and today, newest first."""
+    today, windows = http_client.response_store.get_today(), []
+    for i in range(days // window_size + 1):
+        from_date = today - timedelta(days=min(days, (i + 1) * window_size - 1))
+        windows.append((from_date, today - timedelta(days=i * window_size)))
+    return windows
+
+
+def probe_contract_history_windows(contract, windows: list[tuple[date, date]]) -> int:
+    """Binary search for the number of windows (newest first) needed to reach the oldest trade of the contract."""
+    oldest_date = windows[-1][0]
+    low, high = 0, len(windows)
+    while low < high:
+        middle = (low + high) // 2
+        if get_contract_history(contract, oldest_date, windows[middle][1], page_size=1):
+            low = middle + 1
+        else:
+            high = middle
+
+    return low
+
+
+def update_contract_history_item(contract, days: int | None = None, batch_size: int = 100, max_workers: int = 4,
+                                 writer=None, revision_days: int = 0) -> tuple[int, int]:
+    if http_client.response_store.enabled:
+        # recorded histories are whole, so a capture replays into any database state
+        days = 200000
+    elif days is None:
         days = (date.today() - contract.last_day_history()['date']).days - 1 if contract.history_size() > 0 else 200000
+    days = max(days, revision_days)
 
-    contract_histories = []
-    for i in range(days // 90 + 1):
-        from_date = date.today() - timedelta(days=min(days, (i + 1) * 90 - 1))
-        to_date = min(date.today(), from_date + timedelta(days=90 - 1))
-        history_response = submit_request(method='post',
-                                          url='https://dataapi.ime.co.ir/api/CDC/CDCTrades',
-                                          data={"fromDate": str(from_date),
-                                                "toDate": str(to_date),
-                                                "pageNumber": 1,
-                                                "pageSize": 90,
-                                                "marketId": 22,
-                                                "customFilter": str(contract.commodity_id)},
-                                          headers={'User-Agent': user_agent.Random()},
-                                          timeout=30).json()
-
-        if not history_response['Data']:
-            if contract_histories:
-                break
-
-        for row in history_response['Data']:
-            data = {'contract': contract,
-                    'date': make_aware(datetime.fromisoformat(row['DT'])).date(),
-                    'high': row['MaxPrice'],
-                    'low': row['MinPrice'],
-                    'close': row['TodaySettlementPrice'],
-                    'last': row['LastPrice'],
-                    'first': row['FirstPrice'],
-                    'open': row['LastSettlementPrice'],
-                    'value': row['TradesValue'],
-                    'volume': row['TradesVolume'],
-                    'count': row['C_Buy'] + row['C_Sell'],
-                    }
-
-            if data['count'] == 0:
-                continue
-
-            if DailyHistory.objects.filter(contract=contract, date=data['date']).exists():
-                break
-
-            contract_histories.append(DailyHistory(**data))
-
-    DailyHistory.objects.bulk_create(reversed(contract_histories), batch_size=batch_size)
+    windows = get_contract_history_windows(days)
+    if len(windows) > max_workers:
+        windows = windows[:probe_contract_history_windows(contract, windows)]
+
+    histories_by_date: dict[date, DailyHistory] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for rows in pool.map(lambda window: get_contract_history(contract, *window), windows):
+            for row in rows:
+                data = {'contract': contract,
+                        'date': make_aware(datetime.fromisoformat(row['DT'])).date(),
+                        'high': row['MaxPrice'],
+                        'low': row['MinPrice'],
+                        'close': row['TodaySettlementPrice'],
+                        'last': row['LastPrice'],
+                        'first': row['FirstPrice'],
+                        'open': row['LastSettlementPrice'],
+                        'value': row['TradesValue'],
+                        'volume': row['TradesVolume'],
+                        'count': row['C_Buy'] + row['C_Sell'],
+                        }
+
+                if data['count'] == 0:
+                    continue
+
+                histories_by_date.setdefault(data['date'], DailyHistory(**data))
+
+    contract_histories = sorted(histories_by_date.values(), key=lambda history: history.date)
+    if revision_days:
+        contract_histories, revised = split_revised_histories(contract, contract_histories)
+    else:
+        stored_dates = get_stored_dates(contract, contract_histories)
+        contract_histories = [history for history in contract_histories if history.date not in stored_dates]
+        revised = []
+
+    if writer is not None:
+        writer.submit(contract, contract_histories, revised)
+    else:
+        store_histories(contract, contract_histories, batch_size, revised)
 
     if contract_histories:
         logger.info(f"history of {contract.code} in {len(contract_histories)} days added.")
+    if revised:
+        logger.info(f"history of {contract.code} in {len(revised)} days revised.")
+
+    return len(contract_histories), len(revised)
@@ -0,0 +1,100 @@
+import functools
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+
+class HistoryCache:
+    """
+    LRU cache of history handler results bounded by their measured size in bytes. Entries are keyed by model, primary
+    key, method, arguments and the current date instead of the instance, so they don't keep model instances alive, and
+    entries of an asset are dropped as soon as its histories change.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple, tuple[object, int]] = OrderedDict()
+        self.keys_by_asset: dict[tuple, set[tuple]] = defaultdict(set)
+        self.bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_asset_key(asset) -> tuple:
+        return asset._meta.label, asset.pk
+
+    @staticmethod
+    def get_size(value) -> int:
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return int(np.sum(value.memory_usage(index=True, deep=True)))
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(map(sys.getsizeof, value.values()))
+        return sys.getsizeof(value)
+
+    def cached(self, method):
+        @functools.wraps(method)
+        def wrapper(asset, *args, **kwargs):
+            asset_key = HistoryCache.get_asset_key(asset)
+            key = (*asset_key, method.__name__, args, tuple(sorted(kwargs.items())), date.today())
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key][0]
+                self.misses += 1
+
+            value = method(asset, *args, **kwargs)
+            self.set(asset_key, key, value)
+            return value
+
+        return wrapper
+
+    def set(self, asset_key: tuple, key: tuple, value):
+        size = HistoryCache.get_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries[key][1]
+            self.entries[key] = (value, size)
+            self.keys_by_asset[asset_key].add(key)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                self.remove(*self.entries.popitem(last=False))
+                self.evictions += 1
+
+    def remove(self, key: tuple, entry: tuple[object, int]):
+        self.bytes -= entry[1]
+        keys = self.keys_by_asset[key[:2]]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_asset[key[:2]]
+
+    def invalidate(self, asset):
+        with self.lock:
+            for key in self.keys_by_asset.pop(HistoryCache.get_asset_key(asset), set()):
+                self.bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_asset.clear()
+            self.bytes = 0
+
+    def __str__(self):
+        return (f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions, {len(self.entries)} entries, "
+                f"{round(self.bytes / 2 ** 20, 2)}MB")
+
+
+history_cache = HistoryCache(settings.HISTORY_CACHE_MAX_BYTES)
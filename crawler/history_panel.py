@@ -0,0 +1,147 @@
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import QuerySet
+
+from crawler.history_cache import history_cache
+from crawler.history_store import HistoryStore
+
+
+class HistoryPanel:
+    """
+    Daily histories of a universe of assets loaded by one streamed query. Rows are kept in (asset, date) order in
+    contiguous arrays with the store layout, so the history of an asset is a slice of them. While a panel is active,
+    history handlers of its assets read from it instead of the database.
+
+    A panel can be published as npy files after ingest, other processes attach to the last published panel as read
+    only memory maps (when HISTORY_PANEL is enabled) and use it for the assets not changed by themselves since.
+    """
+    active: 'HistoryPanel | None' = None
+    shared: dict[type, 'HistoryPanel'] = {}
+    changed: set[tuple] = set()
+
+    def __init__(self, model, asset_ids: np.ndarray, data: np.ndarray, index: np.ndarray, generation: str = ''):
+        """Rows of the index are the asset id, start and stop of the histories of each asset in data."""
+        self.model = model
+        self.asset_ids = asset_ids
+        self.data = data
+        self.index = index
+        self.generation = generation
+
+        self.universe: set[int] = set(asset_ids.tolist())
+        self.slices: dict[int, tuple[int, int]] = {asset_id: (start, stop) for asset_id, start, stop in
+                                                   index.tolist()}
+
+    @classmethod
+    def load(cls, assets: QuerySet, chunk_size: int = 10 ** 5) -> 'HistoryPanel':
+        relation = assets.model._meta.get_field('history')
+        field = relation.field.name
+        rows = relation.related_model.objects.filter(**{f'{field}__in': assets}).order_by(field, 'date').values_list(
+            f'{field}_id', 'date', *HistoryStore.FIELDS).iterator(chunk_size=chunk_size)
+
+        row_asset_ids, chunks = [np.empty(0, dtype=np.int64)], [HistoryStore.from_rows([])]
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            row_asset_ids.append(np.array([row[0] for row in chunk], dtype=np.int64))
+            chunks.append(HistoryStore.from_rows((row[1:] for row in chunk), sort=False))
+
+        row_asset_ids = np.concatenate(row_asset_ids)
+        ids, starts = np.unique(row_asset_ids, return_index=True)
+        stops = np.append(starts, len(row_asset_ids))[1:]
+
+        return cls(assets.model, np.fromiter(assets.values_list('pk', flat=True), dtype=np.int64),
+                   np.concatenate(chunks, axis=1), np.stack([ids, starts, stops], axis=1))
+
+    @staticmethod
+    def get_root(model) -> str:
+        return os.path.join(settings.HISTORY_PANEL['PATH'], model.__name__.lower())
+
+    def publish(self, keep: int = 2):
+        """Writes the panel into a new generation directory and atomically points the current link to it."""
+        root = HistoryPanel.get_root(self.model)
+        generation = str(time.time_ns())
+        os.makedirs(os.path.join(root, generation))
+        for name in ['asset_ids', 'data', 'index']:
+            np.save(os.path.join(root, generation, f'{name}.npy'), getattr(self, name))
+
+        link = os.path.join(tempfile.mkdtemp(dir=root), 'current')
+        os.symlink(generation, link)
+        os.replace(link, os.path.join(root, 'current'))
+        os.rmdir(os.path.dirname(link))
+
+        # mapped files of removed generations stay readable for processes attached to them
+        for old in sorted(name for name in os.listdir(root) if name.isdigit())[:-keep]:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+    @classmethod
+    def attach(cls, model) -> 'HistoryPanel | None':
+        """Last published panel of the model as read only memory maps, None if nothing is published."""
+        root = HistoryPanel.get_root(model)
+        try:
+            generation = os.readlink(os.path.join(root, 'current'))
+        except OSError:
+            return None
+
+        panel = cls.shared.get(model)
+        if panel is None or panel.generation != generation:
+            arrays = {name: np.load(os.path.join(root, generation, f'{name}.npy'), mmap_mode='r') for name in
+                      ['asset_ids', 'data', 'index']}
+            panel = cls.shared[model] = cls(model, **arrays, generation=generation)
+            history_cache.clear()
+
+        return panel
+
+    @staticmethod
+    def get_shared(asset) -> 'HistoryPanel | None':
+        if not settings.HISTORY_PANEL['ENABLED'] or (type(asset), asset.pk) in HistoryPanel.changed:
+            return None
+
+        panel = HistoryPanel.attach(type(asset))
+        return panel if panel is not None and asset in panel else None
+
+    @staticmethod
+    def invalidate(asset):
+        """Histories of the asset are changed after the shared panel was published."""
+        HistoryPanel.changed.add((type(asset), asset.pk))
+
+    def __contains__(self, asset) -> bool:
+        return isinstance(asset, self.model) and asset.pk in self.universe
+
+    def __len__(self) -> int:
+        return self.data.shape[1]
+
+    @contextmanager
+    def activate(self):
+        previous, HistoryPanel.active = HistoryPanel.active, self
+        try:
+            yield self
+        finally:
+            HistoryPanel.active = previous
+
+    @staticmethod
+    def get_active(asset) -> 'HistoryPanel | None':
+        panel = HistoryPanel.active
+        return panel if panel is not None and asset in panel else HistoryPanel.get_shared(asset)
+
+    def get_array(self, asset, until: date | None = None) -> np.ndarray:
+        """View over the histories of the asset, up to and including the until date."""
+        start, stop = self.slices.get(asset.pk, (0, 0))
+        array = self.data[:, start:stop]
+        if until is not None:
+            array = array[:, :np.searchsorted(array[0], (until - HistoryStore.EPOCH).days, side='right')]
+        return array
+
+    def get_dataframe(self, asset, until: date | None = None) -> pd.DataFrame:
+        return HistoryStore.to_dataframe(self.get_array(asset, until))
+
+    @staticmethod
+    def to_record(array: np.ndarray, loc: int) -> dict:
+        return {'date': array[0, loc].astype('datetime64[D]').item(),
+                **dict(zip(HistoryStore.COLUMNS, array[1:, loc].tolist()))}
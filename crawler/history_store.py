@@ -0,0 +1,98 @@
+import os
+import tempfile
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+
+class HistoryStore:
+    """
+    Columnar copy of the daily history, one memory mapped npy file per asset. Row 0 of a file holds the dates as days
+    since epoch and the next rows hold COLUMNS and the float64 bits of FACTORS, so every column is a contiguous slice
+    of the file. The database stays the source of truth, files are written at ingest and can be rebuilt by the
+    build_history_store command.
+    """
+    EPOCH = date(1970, 1, 1)
+    COLUMNS = ['first', 'high', 'low', 'last', 'volume', 'value', 'open', 'close', 'count']
+    FACTORS = ['scale_factor', 'shift_factor']
+    FIELDS = COLUMNS + FACTORS
+    FRAME_COLUMNS = COLUMNS[:-1]
+
+    def __init__(self, path: str, enabled: bool = False):
+        self.path = path
+        self.enabled = enabled
+
+    def get_file_path(self, asset) -> str:
+        return os.path.join(self.path, type(asset).__name__.lower(), f'{asset.pk}.npy')
+
+    @staticmethod
+    def from_rows(rows, sort: bool = True) -> np.ndarray:
+        """Builds a store array from (date, *FIELDS) rows."""
+        rows = list(rows)
+        array = np.empty((len(HistoryStore.FIELDS) + 1, len(rows)), dtype=np.int64)
+        if rows:
+            columns = len(HistoryStore.COLUMNS) + 1
+            array[0] = np.array([row[0] for row in rows], dtype='datetime64[D]').astype(np.int64)
+            array[1:columns] = np.array([row[1:columns] for row in rows], dtype=np.int64).T
+            array[columns:] = np.array([row[columns:] for row in rows], dtype=np.float64).T.view(np.int64)
+        return array[:, np.argsort(array[0], kind='stable')] if sort else array
+
+    @staticmethod
+    def from_histories(histories) -> np.ndarray:
+        return HistoryStore.from_rows(
+            [history.date, *[getattr(history, field) for field in HistoryStore.FIELDS]] for history in histories)
+
+    @staticmethod
+    def get_factors(array: np.ndarray) -> np.ndarray:
+        return array[len(HistoryStore.COLUMNS) + 1:].view(np.float64)
+
+    @staticmethod
+    def to_dataframe(array: np.ndarray) -> pd.DataFrame:
+        """Same frame as the orm read path, price and factor columns are views over the (memory mapped) array."""
+        df = pd.DataFrame(array[1:len(HistoryStore.FRAME_COLUMNS) + 1].T, columns=HistoryStore.FRAME_COLUMNS,
+                          copy=False)
+        df[HistoryStore.FACTORS] = pd.DataFrame(HistoryStore.get_factors(array).T, copy=False)
+        df.insert(0, 'date', array[0].astype('datetime64[D]').astype(object))
+        return df
+
+    def read(self, asset) -> np.ndarray | None:
+        try:
+            array = np.load(self.get_file_path(asset), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+
+        # files of an older layout are ignored until they are rebuilt
+        return array if array.shape[0] == len(HistoryStore.FIELDS) + 1 else None
+
+    def read_dataframe(self, asset) -> pd.DataFrame | None:
+        array = self.read(asset)
+        return None if array is None else HistoryStore.to_dataframe(array)
+
+    def write(self, asset, array: np.ndarray):
+        file_path = self.get_file_path(asset)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        # readers keep their mapping of the old file, the new one replaces it atomically
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(file_path), suffix='.npy', delete=False) as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(f.name, file_path)
+
+    def rebuild(self, asset):
+        self.write(asset, HistoryStore.from_rows(
+            asset.history.all().order_by('date').values_list('date', *HistoryStore.FIELDS)))
+
+    def append(self, asset, histories):
+        """Merges new histories of an asset into its file, the file is built from the database if missing."""
+        existing = self.read(asset)
+        if existing is None:
+            self.rebuild(asset)
+            return
+
+        new = HistoryStore.from_histories(histories)
+        merged = np.concatenate([existing[:, ~np.isin(existing[0], new[0])], new], axis=1)
+        self.write(asset, merged[:, np.argsort(merged[0], kind='stable')])
+
+
+history_store = HistoryStore(settings.HISTORY_STORE['PATH'], settings.HISTORY_STORE['ENABLED'])
@@ -0,0 +1,87 @@
+import logging
+import queue
+import threading
+import time
+
+from django.db import transaction, connection
+
+from crawler.helper import store_histories
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    """
+    Dedicated thread storing the histories fetch workers put on its queue. Histories of many assets are committed in
+    one transaction (each asset in its own savepoint), so concurrent fetches no longer contend for the database lock.
+    """
+
+    def __init__(self, batch_rows: int = 10000, max_delay: float = 2, max_pending: int = 100, batch_size: int = 100):
+        self.batch_rows = batch_rows
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.run, name='history-writer', daemon=True)
+        self.stored: int = 0
+        self.transactions: int = 0
+        self.failures: int = 0
+
+    def __enter__(self) -> 'HistoryWriter':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.queue.put(None)
+        self.thread.join()
+        logger.info(f"history writer stored {self.stored} histories in {self.transactions} transactions, "
+                    f"{self.failures} assets failed.")
+
+    def submit(self, asset, histories: list, revised: list | None = None):
+        """Blocks while the writer is behind by max_pending submissions."""
+        if histories or revised:
+            self.queue.put((asset, histories, revised))
+
+    def get_batch(self) -> tuple[list, bool]:
+        batch, rows, deadline = [], 0, time.time() + self.max_delay
+        while rows < self.batch_rows:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.time())) if batch else self.queue.get()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            rows += len(item[1]) + len(item[2] or [])
+
+        return batch, False
+
+    def write(self, batch: list):
+        stored = 0
+        with transaction.atomic():
+            for asset, histories, revised in batch:
+                try:
+                    with transaction.atomic():
+                        store_histories(asset, histories, self.batch_size, revised)
+                    stored += len(histories) + len(revised or [])
+                except Exception:
+                    self.failures += 1
+                    logger.exception(f"storing histories of {asset} failed!")
+
+        self.stored += stored
+        self.transactions += 1
+
+    def run(self):
+        try:
+            finished = False
+            while not finished:
+                batch, finished = self.get_batch()
+                if not batch:
+                    continue
+
+                try:
+                    self.write(batch)
+                except Exception:
+                    self.failures += len(batch)
+                    logger.exception(f"storing histories of {len(batch)} assets failed!")
+        finally:
+            connection.close()
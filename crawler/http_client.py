@@ -0,0 +1,266 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import cached_property
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from crawler.response_store import ResponseStore
+
+logger = logging.getLogger(__name__)
+
+
+class HostMetrics:
+    def __init__(self):
+        self.requests: int = 0
+        self.errors: int = 0
+        self.throttles: int = 0
+        self.retries: int = 0
+        self.bytes: int = 0
+        self.latency: float = 0
+
+    def __str__(self):
+        average_latency = self.latency / self.requests if self.requests else 0
+        return (f"{self.requests} requests, {self.errors} errors, {self.retries} retries, "
+                f"{round(self.bytes / 2 ** 20, 2)}MB, {round(average_latency, 3)}s avg latency")
+
+
+class CircuitOpenError(Exception):
+    """Request refused by an open circuit, it can be tried again after retry_after seconds unless it is None."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures of a host and lets a single probe through after
+    recovery_timeout. Calls refused before the first probe may wait for it, once a probe fails the host is considered
+    down and calls are refused without a wait until a probe succeeds.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, host: str, failure_threshold: int = 20, recovery_timeout: float = 30,
+                 probe_interval: float = 1):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.probe_interval = probe_interval
+        self.state: str = CircuitBreaker.CLOSED
+        self.failures: int = 0
+        self.opened_at: float = 0
+        self.probing: bool = False
+        self.down: bool = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        with self.lock:
+            if self.state == CircuitBreaker.OPEN:
+                remaining = self.opened_at + self.recovery_timeout - time.time()
+                if remaining > 0:
+                    raise CircuitOpenError(f"Circuit of {self.host} is open", None if self.down else remaining)
+                self.state = CircuitBreaker.HALF_OPEN
+
+            if self.state == CircuitBreaker.HALF_OPEN:
+                if self.probing:
+                    raise CircuitOpenError(f"Circuit of {self.host} is half open, waiting for probe",
+                                           None if self.down else self.probe_interval)
+                self.probing = True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CircuitBreaker.CLOSED:
+                logger.info(f"circuit of {self.host} closed")
+            self.state, self.failures, self.probing, self.down = CircuitBreaker.CLOSED, 0, False, False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.down = self.down or self.state == CircuitBreaker.HALF_OPEN
+            if self.state == CircuitBreaker.HALF_OPEN or (
+                    self.state == CircuitBreaker.CLOSED and self.failures >= self.failure_threshold):
+                logger.warning(f"circuit of {self.host} opened after {self.failures} consecutive failures")
+                self.state, self.opened_at, self.probing = CircuitBreaker.OPEN, time.time(), False
+
+
+class RetryBudget:
+    """Shared token bucket, every request deposits ratio tokens and every retry withdraws one."""
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 10, max_tokens: float = 100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens: float = min_tokens
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class HttpClient:
+    """Keeps one keep-alive session per host, so connections and their TLS handshakes are reused between calls."""
+    VALIDATORS_CACHE_KEY = 'http_validators'
+
+    def __init__(self, pool_size: int = 32):
+        self.pool_size = pool_size
+        self.sessions: dict[str, requests.Session] = {}
+        self.metrics: dict[str, HostMetrics] = defaultdict(HostMetrics)
+        self.circuit_breakers: dict[str, CircuitBreaker] = {}
+        self.validators: dict[str, dict[str, str]] = {}
+        self.pending_validators: dict[str, dict[str, str]] = {}
+        self.retry_budget = RetryBudget()
+        self.lock = threading.Lock()
+
+    def get_session(self, host: str) -> requests.Session:
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+                self.sessions[host] = session
+
+            return self.sessions[host]
+
+    def get_circuit_breaker(self, host: str) -> CircuitBreaker:
+        with self.lock:
+            if host not in self.circuit_breakers:
+                self.circuit_breakers[host] = CircuitBreaker(host)
+
+            return self.circuit_breakers[host]
+
+    @cached_property
+    def response_store(self) -> ResponseStore:
+        return ResponseStore(settings.HTTP_RESPONSE_STORE['PATH'], settings.HTTP_RESPONSE_STORE['MODE'])
+
+    def request(self, method: str, url: str, conditional: bool = False, **kwargs) -> requests.Response:
+        body = kwargs.get('json', kwargs.get('data'))
+        if self.response_store.mode == ResponseStore.REPLAY:
+            response = requests.Response()
+            response.status_code, response._content, response.encoding = self.response_store.load(
+                method, url, kwargs.get('params'), body)
+            response.url, response.validator_key = url, None
+            return response
+
+        validator_key = ResponseStore.get_key(method, url, kwargs.get('params'), body)
+        if conditional and validator_key in self.validators:
+            kwargs['headers'] = {**(kwargs.get('headers') or {}), **self.validators[validator_key]}
+
+        host = urlsplit(url).hostname
+        self.get_circuit_breaker(host).before_request()
+
+        t = time.time()
+        try:
+            response = self.get_session(host).request(method.upper(), url, **kwargs)
+        except Exception:
+            self.record(host, time.time() - t)
+            raise
+
+        self.record(host, time.time() - t, size=len(response.content), status_code=response.status_code)
+        # validators are kept once the caller commits them, after it has processed the response
+        response.validator_key = validator_key if conditional and response.status_code == 200 else None
+        if response.validator_key is not None:
+            self.pending_validators[validator_key] = {
+                header: response.headers[name] for name, header in
+                [('ETag', 'If-None-Match'), ('Last-Modified', 'If-Modified-Since')] if name in response.headers}
+        if self.response_store.mode == ResponseStore.RECORD:
+            self.response_store.save(method, url, kwargs.get('params'), body, response.status_code, response.content,
+                                     response.encoding)
+        return response
+
+    async def async_request(self, session: aiohttp.ClientSession, method: str, url: str, params=None,
+                            headers: dict | None = None, json: dict | None = None, timeout: int = 5) -> tuple[int, str]:
+        if self.response_store.mode == ResponseStore.REPLAY:
+            status_code, content, encoding = self.response_store.load(method, url, params, json)
+            return status_code, content.decode(encoding or 'utf-8')
+
+        host = urlsplit(url).hostname
+        self.get_circuit_breaker(host).before_request()
+
+        t = time.time()
+        try:
+            async with session.request(method.upper(), url, params=params, headers=headers, json=json,
+                                       timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                content = await response.read()
+                text = await response.text()
+        except Exception:
+            self.record(host, time.time() - t)
+            raise
+
+        self.record(host, time.time() - t, size=len(content), status_code=response.status)
+        if self.response_store.mode == ResponseStore.RECORD:
+            self.response_store.save(method, url, params, json, response.status, content, response.get_encoding())
+        return response.status, text
+
+    def load_validators(self):
+        """Loads ETag and Last-Modified validators of conditional requests kept by the last run."""
+        self.validators.update(cache.get(HttpClient.VALIDATORS_CACHE_KEY, {}))
+
+    def commit_validators(self, keys):
+        """Keeps validators of the processed responses for the conditional requests of the next runs."""
+        for key in keys:
+            if key in self.pending_validators:
+                self.validators[key] = self.pending_validators.pop(key)
+
+    def drop_validator(self, key: str | None):
+        """Forgets validators of a response its caller could not process, so the next run fetches it again."""
+        self.pending_validators.pop(key, None)
+        self.validators.pop(key, None)
+
+    def save_validators(self):
+        cache.set(HttpClient.VALIDATORS_CACHE_KEY, {key: value for key, value in self.validators.items() if value},
+                  timeout=None)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('get', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('post', url, **kwargs)
+
+    def record(self, host: str, latency: float, size: int = 0, status_code: int | None = None):
+        with self.lock:
+            metrics = self.metrics[host]
+            metrics.requests += 1
+            metrics.errors += int(status_code is None or status_code >= 400)
+            metrics.throttles += int(status_code is None or status_code == 429 or status_code >= 500)
+            metrics.bytes += size
+            metrics.latency += latency
+
+        self.retry_budget.deposit()
+        if status_code is None or status_code == 429 or status_code >= 500:
+            self.get_circuit_breaker(host).record_failure()
+        else:
+            self.get_circuit_breaker(host).record_success()
+
+    def record_retry(self, url: str):
+        with self.lock:
+            self.metrics[urlsplit(url).hostname].retries += 1
+
+    def snapshot(self) -> tuple[int, int, float]:
+        with self.lock:
+            return (sum(metrics.requests for metrics in self.metrics.values()),
+                    sum(metrics.throttles for metrics in self.metrics.values()),
+                    sum(metrics.latency for metrics in self.metrics.values()))
+
+    def log_metrics(self):
+        with self.lock:
+            for host, metrics in sorted(self.metrics.items()):
+                logger.info(f"http {host}: {metrics}")
+
+
+http_client = HttpClient()
@@ -0,0 +1,73 @@
+import math
+from datetime import date
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+
+class MACD:
+    """
+    MACD of closes with the exponential means (adjust=True) stockstats computes, kept as a running state. The means are
+    linear, so the state is kept over closes times their forward scale factor and read back divided by the factor of
+    the last day, then histories appended with their factors move it forward in O(1) per day.
+    """
+
+    def __init__(self, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9):
+        self.periods = [fast_period, slow_period, signal_period]
+
+    @property
+    def name(self) -> str:
+        return 'macd_{}_{}_{}'.format(*self.periods)
+
+    @staticmethod
+    def update_mean(mean: list | None, value: float, period: int) -> list:
+        """Next [weighted mean, weight of the old values] of pandas ewm(span=period, adjust=True)."""
+        if mean is None:
+            return [value, 1.0]
+
+        weighted, old_weight = mean
+        old_weight *= 1 - 2 / (period + 1)
+        if weighted != value:
+            weighted = (old_weight * weighted + value) / (old_weight + 1)
+        return [weighted, old_weight + 1]
+
+    def update(self, state: dict | None, values: Iterable[tuple[date, float, float]]) -> dict | None:
+        """Moves the state forward over (date, close, scale_factor) of new days, None if it can not be kept."""
+        state = dict(state) if state is not None else {'fast': None, 'slow': None, 'signal': None, 'macd': [],
+                                                        'macds': []}
+        for d, close, scale_factor in values:
+            value = close * scale_factor
+            state['fast'] = MACD.update_mean(state['fast'], value, self.periods[0])
+            state['slow'] = MACD.update_mean(state['slow'], value, self.periods[1])
+            macd = state['fast'][0] - state['slow'][0]
+            state['signal'] = MACD.update_mean(state['signal'], macd, self.periods[2])
+            state['macd'] = (state['macd'] + [macd])[-2:]
+            state['macds'] = (state['macds'] + [state['signal'][0]])[-2:]
+            state['date'], state['scale_factor'] = d.isoformat(), scale_factor
+
+        # stored as json, which has no nan or infinity
+        if 'date' not in state or not state['scale_factor']:
+            return None
+        return state if all(map(math.isfinite, [state['scale_factor'], *state['macd'], *state['macds']])) else None
+
+    def get_series(self, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """MACD and signal of every day of the values."""
+        macd, macds = np.empty(len(values)), np.empty(len(values))
+        fast = slow = signal = None
+        for i, value in enumerate(values.tolist()):
+            fast = MACD.update_mean(fast, value, self.periods[0])
+            slow = MACD.update_mean(slow, value, self.periods[1])
+            macd[i] = fast[0] - slow[0]
+            signal = MACD.update_mean(signal, macd[i], self.periods[2])
+            macds[i] = signal[0]
+        return macd, macds
+
+    def compute(self, df: pd.DataFrame) -> dict | None:
+        """State over a frame of date, close and scale_factor columns."""
+        return self.update(None, zip(df['date'], df['close'].tolist(), df['scale_factor'].tolist()))
+
+    @staticmethod
+    def read(state: dict) -> tuple[np.ndarray, np.ndarray]:
+        """Last (up to) two MACD and signal values, in prices adjusted to the last day of the state."""
+        return np.array(state['macd']) / state['scale_factor'], np.array(state['macds']) / state['scale_factor']
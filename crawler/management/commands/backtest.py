@@ -0,0 +1,69 @@
+import logging
+from datetime import date, timedelta
+
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from crawler.analyzers import *
+from crawler.analyzers.analyzer import BacktestAnalyzer
+from crawler.analyzers.timeline import AssetTimeline
+from crawler.history_panel import HistoryPanel
+from crawler.history_store import HistoryStore
+from crawler.models import Share
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Backtest the daily analyzers over a date range'
+    requires_migrations_checks = True
+
+    def __init__(self, *args, **kwargs):
+        self.analyzers = [AirAnalyzer(), BuyQueueAnalyzer(), CheapRightIssueAnalyzer(), GoodPriceRightIssueAnalyzer(),
+                          MACDCrossAnalyzer(), NewComerDropAnalyzer(), OptionAnalyzer(), VolumeAnalyzer()]
+
+        super().__init__(*args, **kwargs)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_date', type=date.fromisoformat,
+                            default=date.today() - timedelta(days=365))
+        parser.add_argument('--to', dest='to_date', type=date.fromisoformat, default=date.today())
+        parser.add_argument('--output', default=settings.BASE_DIR + "/data/backtest.csv",
+                            help='csv file the signal table is written to')
+
+    def handle(self, *args, **options):
+        panel = HistoryPanel.attach(Share) if settings.HISTORY_PANEL['ENABLED'] else None
+        panel = panel or HistoryPanel.load(Share.objects.all())
+
+        df = self.backtest(panel, options['from_date'], options['to_date'])
+        df.to_csv(options['output'], index=False)
+        logger.info(f"{len(df)} signals of {df['asset_id'].nunique()} shares written to {options['output']}")
+        for signal, count in df['signal'].value_counts().items():
+            logger.info(f"{signal}: {count}")
+
+    def backtest(self, panel: HistoryPanel, from_date: date, to_date: date) -> pd.DataFrame:
+        """
+        Signals of the analyzers on every day an asset is traded in the range, as analyze returns them with the day
+        as the last day of its history. Every asset timeline is built once and analyzed in one pass.
+        """
+        shares = [share for share in Share.objects.order_by('ticker') if share in panel]
+        timelines = {share.pk: AssetTimeline(share, panel.get_array(share)) for share in shares}
+        days = [(from_date - HistoryStore.EPOCH).days, (to_date - HistoryStore.EPOCH).days]
+
+        rows = []
+        for share in shares:
+            timeline = timelines[share.pk]
+            in_range = (timeline.days >= days[0]) & (timeline.days <= days[1])
+            if not in_range.any():
+                continue
+
+            for analyzer in self.analyzers:
+                for loc, signal, payload in analyzer.get_signals(timeline, timelines):
+                    if in_range[loc]:
+                        rows.append({'asset_id': share.pk, 'asset': share.ticker, 'signal': signal,
+                                     'date': HistoryStore.EPOCH + timedelta(days=int(timeline.days[loc])),
+                                     'payload': str(payload)})
+
+        return pd.DataFrame(rows, columns=['asset_id', 'asset', 'date', 'signal', 'payload']).sort_values(
+            ['date', 'asset', 'signal'], kind='stable', ignore_index=True)
@@ -0,0 +1,19 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from crawler.models import Share, Contract, AssetSummary
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild asset summaries from the database'
+
+    def handle(self, *args, **options):
+        for model in [Share, Contract]:
+            assets = list(model.objects.select_related('summary'))
+            for asset in assets:
+                AssetSummary.update_asset(asset, [], appended=False)
+
+            logger.info(f"summary of {len(assets)} {model.__name__.lower()}s built")
@@ -0,0 +1,26 @@
+import itertools
+import logging
+
+from django.core.management.base import BaseCommand
+
+from crawler.history_store import history_store, HistoryStore
+from crawler.models import DailyHistory, Share, Contract
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the columnar history store from the database'
+
+    def handle(self, *args, **options):
+        for model, field in [(Share, 'share_id'), (Contract, 'contract_id')]:
+            assets = model.objects.in_bulk()
+            rows = DailyHistory.objects.filter(**{f'{field}__isnull': False}).order_by(field, 'date').values_list(
+                field, 'date', *HistoryStore.FIELDS).iterator(chunk_size=10 ** 4)
+
+            count = 0
+            for asset_id, asset_rows in itertools.groupby(rows, key=lambda row: row[0]):
+                history_store.write(assets[asset_id], HistoryStore.from_rows(row[1:] for row in asset_rows))
+                count += 1
+
+            logger.info(f"history store of {count} {model.__name__.lower()}s built in {history_store.path}")
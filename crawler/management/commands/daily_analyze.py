@@ -1,11 +1,22 @@
+import itertools
 import logging
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
+from functools import partial
 
 import pandas as pd
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q, QuerySet
 
 from crawler.analyzers import *
+from crawler.analyzers.analyzer import PanelAnalyzer
+from crawler.analyzers.market_panel import MarketPanel
+from crawler.history_cache import history_cache
+from crawler.history_panel import HistoryPanel
 from crawler.models import Share
 
 logger = logging.getLogger(__name__)
@@ -24,24 +35,20 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('days', type=int, nargs='?', default=0)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='number of processes the shares are sharded across')
 
     def handle(self, *args, **options):
         day_offset = options.get('days', 0)
 
-        row_list = []
-        for share in Share.objects.all().order_by('ticker'):
-            if share.history_size(day_offset) > 0 and share.last_day_history(day_offset)['date'] >= Share.get_today_new(
-                    day_offset) - timedelta(days=1):
-                results = dict()
-                for analyzer in self.daily_analyzers:
-                    result = analyzer.analyze(share, day_offset)
-                    if result:
-                        results.update({key: str(value) for key, value in result.items()})
-
-                if results:
-                    ticker_link = f'<a href="http://old.tsetmc.com/Loader.aspx?ParTree=151311&i={share.id}">{share.ticker}</a>'
-                    row_list.append({"ticker": ticker_link, **results})
-                    logger.info(f"{share.ticker}: {results}")
+        if options['workers'] > 1:
+            row_list = self.analyze_in_workers(day_offset, options['workers'])
+        else:
+            panel = HistoryPanel.attach(Share) if settings.HISTORY_PANEL['ENABLED'] else None
+            panel = panel or HistoryPanel.load(Share.objects.all())
+            with panel.activate():
+                row_list = self.analyze(day_offset, panel)
+            logger.info(f"history cache: {history_cache}")
 
         if row_list:
             df = pd.DataFrame(row_list)
@@ -55,3 +62,67 @@ class Command(BaseCommand):
 
             with open(settings.BASE_DIR + "/data/report.html", 'w') as f:
                 f.write(html_out)
+
+    @staticmethod
+    def get_shares(day_offset: int) -> QuerySet:
+        return Share.objects.filter(Q(summary__isnull=True) | Q(
+            summary__last_date__gte=Share.get_today_new(day_offset) - timedelta(days=1))).order_by('ticker')
+
+    def analyze_in_workers(self, day_offset: int, workers: int, shards_per_worker: int = 4) -> list[dict]:
+        """
+        Shards the shares, in order, across a pool of processes. Several shards per worker balance the load, and
+        rows of the shards are concatenated in order, so the report is the same as the one of a single process.
+        """
+        share_ids = list(Command.get_shares(day_offset).values_list('id', flat=True))
+        size = math.ceil(len(share_ids) / (workers * shards_per_worker)) or 1
+        shards = [share_ids[i:i + size] for i in range(0, len(share_ids), size)]
+
+        # forked workers open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            return list(itertools.chain.from_iterable(pool.map(partial(analyze_shard, day_offset), shards)))
+
+    def analyze(self, day_offset: int, panel: HistoryPanel | None = None,
+                share_ids: list[int] | None = None) -> list[dict]:
+        row_list = []
+        shares = Command.get_shares(day_offset)
+        if share_ids is not None:
+            shares = shares.filter(id__in=share_ids)
+        shares = [share for share in shares.select_related('summary') if
+                  share.history_size(day_offset) > 0 and share.last_day_history(day_offset)['date'] >=
+                  Share.get_today_new(day_offset) - timedelta(days=1)]
+
+        for analyzer in self.daily_analyzers:
+            analyzer.prepare(shares, day_offset)
+
+        # signals of panel analyzers are computed for the whole market at once, other analyzers run per share
+        market = MarketPanel(shares, panel, day_offset) if panel is not None else None
+        market_results = {analyzer: analyzer.get_results(market) for analyzer in self.daily_analyzers if
+                          market is not None and isinstance(analyzer, PanelAnalyzer)}
+        for share in shares:
+            results = dict()
+            for analyzer in self.daily_analyzers:
+                if analyzer in market_results and share in market:
+                    result = market_results[analyzer].get(share.id)
+                else:
+                    result = analyzer.analyze(share, day_offset)
+                if result:
+                    results.update({key: str(value) for key, value in result.items()})
+
+            if results:
+                ticker_link = f'<a href="http://old.tsetmc.com/Loader.aspx?ParTree=151311&i={share.id}">{share.ticker}</a>'
+                row_list.append({"ticker": ticker_link, **results})
+                logger.info(f"{share.ticker}: {results}")
+
+        return row_list
+
+
+def analyze_shard(day_offset: int, share_ids: list[int]) -> list[dict]:
+    """Runs in a worker process, histories of the shard and of the assets its analyzers refer to are loaded in bulk."""
+    panel = HistoryPanel.attach(Share) if settings.HISTORY_PANEL['ENABLED'] else None
+    panel = panel or HistoryPanel.load(Share.objects.filter(
+        Q(id__in=share_ids) | Q(base_share__in=share_ids) | Q(options__in=share_ids)).distinct())
+    with panel.activate():
+        row_list = Command().analyze(day_offset, panel, share_ids)
+    logger.info(f"history cache of {len(share_ids)} shares: {history_cache}")
+    return row_list
@@ -1,9 +1,14 @@
 import logging
 from functools import partial
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from crawler.helper import run_jobs, update_share_history_item, update_contract_history_item
+from crawler.helper import run_jobs, update_share_history_item, update_contract_history_item, run_async_jobs, \
+    async_update_share_history_item, plan_share_history, plan_contract_history
+from crawler.history_panel import HistoryPanel
+from crawler.history_writer import HistoryWriter
+from crawler.http_client import http_client
 from crawler.models import Share, DailyHistory, Contract
 
 logger = logging.getLogger(__name__)
@@ -13,16 +18,50 @@ class Command(BaseCommand):
     help = 'Update share history'
     requires_migrations_checks = True
 
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['thread', 'async'], default='thread',
+                            help='ingestion engine used for share histories')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='number of concurrent requests (default: 10 for thread, 50 for async)')
+        parser.add_argument('--adaptive', action='store_true',
+                            help='adjust the number of thread workers from upstream latency and throttling')
+        parser.add_argument('--revision-days', type=int, default=0,
+                            help='re-fetch this many trailing days and upsert the ones revised upstream')
+
     def handle(self, *args, **options):
         history_count: int = DailyHistory.objects.filter(share__isnull=False).count()
         share_list: list[Share] = list(Share.objects.all())
-        jobs = [partial(update_share_history_item, share, last_update=False) for share in share_list]
-        run_jobs("Update Share History", jobs, log=True, log_exception_on_failure=False)
-        Share.objects.bulk_update(share_list, ['last_update'], batch_size=100)
-
         contract_list: list[Contract] = list(Contract.objects.all())
-        jobs = [partial(update_contract_history_item, contract) for contract in contract_list]
-        run_jobs("Update Contract History", jobs, log=True, log_exception_on_failure=False)
+        share_plan = plan_share_history(share_list, options['revision_days'])
+        contract_plan = plan_contract_history(contract_list, options['revision_days'])
+        logger.info(f"{len(share_plan)} of {len(share_list)} shares and {len(contract_plan)} of "
+                    f"{len(contract_list)} contracts can have new histories.")
+        with HistoryWriter() as writer:
+            if options['mode'] == 'async':
+                jobs = [partial(async_update_share_history_item, share, last_update=False, days=days, writer=writer,
+                                revision_days=options['revision_days']) for share, days in share_plan]
+                results = run_async_jobs("Update Share History", jobs, concurrency=options['concurrency'] or 50,
+                                         log=True, log_exception_on_failure=False)
+            else:
+                jobs = [partial(update_share_history_item, share, last_update=False, days=days, writer=writer,
+                                revision_days=options['revision_days']) for share, days in share_plan]
+                results = run_jobs("Update Share History", jobs, max_workers=options['concurrency'] or 10, log=True,
+                                   log_exception_on_failure=False, adaptive=options['adaptive'])
+
+            jobs = [partial(update_contract_history_item, contract, days=days, writer=writer,
+                            revision_days=options['revision_days']) for contract, days in contract_plan]
+            results += run_jobs("Update Contract History", jobs, log=True, log_exception_on_failure=False,
+                                adaptive=options['adaptive'])
+        Share.objects.bulk_update(share_list, ['last_update'], batch_size=100)
 
         new_history_count: int = DailyHistory.objects.filter(share__isnull=False).count()
         logger.info(f"Share history updated. {new_history_count - history_count} added.")
+        if options['revision_days']:
+            revised = [result[1] for result in results if result[1]]
+            logger.info(f"{sum(revised)} histories of {len(revised)} assets revised in the last "
+                        f"{options['revision_days']} days.")
+        if settings.HISTORY_PANEL['ENABLED']:
+            HistoryPanel.load(Share.objects.all()).publish()
+            HistoryPanel.load(Contract.objects.all()).publish()
+            logger.info(f"history panels published in {settings.HISTORY_PANEL['PATH']}")
+        http_client.log_metrics()
@@ -4,6 +4,7 @@ from django.core.management.base import BaseCommand
 
 from crawler.helper import get_share_detailed_info, run_jobs, \
     update_contract_list, update_share_identity
+from crawler.http_client import http_client
 from crawler.models import Share
 
 
@@ -11,11 +12,26 @@ class Command(BaseCommand):
     help = 'Update share info'
     requires_migrations_checks = True
 
+    def add_arguments(self, parser):
+        parser.add_argument('--adaptive', action='store_true',
+                            help='adjust the number of workers from upstream latency and throttling')
+
     def handle(self, *args, **options):
-        jobs = [partial(get_share_detailed_info, share) for share in Share.objects.all()]
-        run_jobs("Update Share Detail Info", jobs, log=True, log_exception_on_failure=False)
+        http_client.load_validators()
+        share_list: list[Share] = list(Share.objects.all())
+
+        jobs = [partial(get_share_detailed_info, share, save=False) for share in share_list]
+        changed = [share for share in run_jobs("Update Share Detail Info", jobs, log=True,
+                                               log_exception_on_failure=False, adaptive=options['adaptive']) if share]
+        Share.objects.bulk_update(changed, ['extra_data', 'extra_data_hash', 'group', 'isin'], batch_size=100)
+        http_client.commit_validators(share.validator_key for share in changed)
 
-        jobs = [partial(update_share_identity, share) for share in Share.objects.all()]
-        run_jobs("Update Share Identity Info", jobs, log=True, log_exception_on_failure=False)
+        jobs = [partial(update_share_identity, share, save=False) for share in share_list]
+        changed = [share for share in run_jobs("Update Share Identity Info", jobs, log=True,
+                                               log_exception_on_failure=False, adaptive=options['adaptive']) if share]
+        Share.objects.bulk_update(changed, ['identity', 'identity_hash'], batch_size=100)
+        http_client.commit_validators(share.validator_key for share in changed)
 
+        http_client.save_validators()
         update_contract_list()
+        http_client.log_metrics()
@@ -4,6 +4,7 @@ from django.core.management.base import BaseCommand
 
 from crawler.helper import update_share_list, update_share_groups, get_share_detailed_info, run_jobs, \
     update_contract_list, update_share_identity
+from crawler.http_client import http_client
 from crawler.models import Share
 
 
@@ -11,14 +12,21 @@ class Command(BaseCommand):
     help = 'Update share list'
     requires_migrations_checks = True
 
+    def add_arguments(self, parser):
+        parser.add_argument('--adaptive', action='store_true',
+                            help='adjust the number of workers from upstream latency and throttling')
+
     def handle(self, *args, **options):
         update_share_groups()
         update_share_list()
 
         jobs = [partial(get_share_detailed_info, share) for share in Share.objects.filter(extra_data__isnull=True)]
-        run_jobs("Update Share Detail Info", jobs, log=True, log_exception_on_failure=False)
+        run_jobs("Update Share Detail Info", jobs, log=True, log_exception_on_failure=False,
+                 adaptive=options['adaptive'])
 
         jobs = [partial(update_share_identity, share) for share in Share.objects.filter(identity__isnull=True)]
-        run_jobs("Update Share Identity Info", jobs, log=True, log_exception_on_failure=False)
+        run_jobs("Update Share Identity Info", jobs, log=True, log_exception_on_failure=False,
+                 adaptive=options['adaptive'])
 
         update_contract_list()
+        http_client.log_metrics()
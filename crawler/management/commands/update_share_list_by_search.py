@@ -4,8 +4,10 @@ from functools import partial
 
 from django.core.management.base import BaseCommand
 
-from crawler.helper import search_share, get_share_detailed_info, run_jobs, update_share_identity
+from crawler.helper import get_share_detailed_info, run_jobs, update_share_identity
+from crawler.http_client import http_client
 from crawler.models import Share
+from crawler.share_search import ShareSearchCrawler
 
 logger = logging.getLogger(__name__)
 
@@ -14,28 +16,23 @@ class Command(BaseCommand):
     help = 'Update share list by search'
     requires_migrations_checks = True
 
+    def add_arguments(self, parser):
+        parser.add_argument('--adaptive', action='store_true',
+                            help='adjust the number of workers from upstream latency and throttling')
+
     def handle(self, *args, **options):
-        persian_char = ["آ", "ا", "ب", "ت", "ث", "ج", "ح", "خ", "د", "ذ", "ر", "ز", "س", "ش", "ص", "ض", "ط", "ظ", "ع",
-                        "غ", "ف", "ق", "ل", "م", "ن", "ه", "و", "پ", "چ", "ژ", "ک", "گ", "ی"]
         tickers = set(Share.objects.all().values_list('ticker', flat=True))
         numbered_tickers = {re.sub(r'[0-9]+', '', ticker) for ticker in tickers if bool(re.search(r'\d', ticker))} - {
             ''}
-        two_chars = [x + y for x in persian_char for y in persian_char]
-
-        three_chars = []
-        for name in two_chars:
-            if Share.objects.filter(ticker__contains=name).count() > 30:
-                for extra_char in persian_char:
-                    three_chars.append(name + extra_char)
-
-        logger.info(f"search for {len(tickers)} ticker name, {len(two_chars)} two and {len(three_chars)} three chars")
 
-        jobs = [partial(search_share, name) for name in list(tickers | numbered_tickers) + two_chars + three_chars]
-        run_jobs("Update Share List by Search", jobs, log=True, log_exception_on_failure=False)
+        ShareSearchCrawler(tickers, adaptive=options['adaptive']).crawl(tickers | numbered_tickers)
 
         jobs = [partial(get_share_detailed_info, share) for share in Share.objects.filter(extra_data__isnull=True)]
-        run_jobs("Update Share Detail Info", jobs, log=True, log_exception_on_failure=False)
+        run_jobs("Update Share Detail Info", jobs, log=True, log_exception_on_failure=False,
+                 adaptive=options['adaptive'])
 
         jobs = [partial(update_share_identity, share) for share in Share.objects.filter(identity__isnull=True)]
-        run_jobs("Update Share Identity Info", jobs, log=True, log_exception_on_failure=False)
+        run_jobs("Update Share Identity Info", jobs, log=True, log_exception_on_failure=False,
+                 adaptive=options['adaptive'])
         logger.info(f"Share list updated. {Share.objects.count() - len(tickers)} new added.")
+        http_client.log_metrics()
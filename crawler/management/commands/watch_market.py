@@ -0,0 +1,50 @@
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crawler.helper import get_watch_list
+from crawler.http_client import http_client
+from crawler.market_watch import MarketSnapshot
+from crawler.time_helper import is_active_hour
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Poll intraday market watch deltas and persist periodic snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1, help='seconds between two polls')
+        parser.add_argument('--snapshot-interval', type=float, default=60, help='seconds between two snapshots')
+        parser.add_argument('--forever', action='store_true', help='keep polling out of the market hours')
+
+    def handle(self, *args, **options):
+        snapshot = MarketSnapshot()
+        last_saved_at = time.time()
+
+        while options['forever'] or is_active_hour():
+            t = time.time()
+            try:
+                updated = snapshot.apply(get_watch_list(h=snapshot.heven, r=snapshot.refid))
+                logger.debug(f"market watch: {updated} rows updated, cursor {snapshot.heven}/{snapshot.refid}")
+            except Exception:
+                logger.exception("market watch poll failed!")
+
+            if time.time() - last_saved_at >= options['snapshot_interval']:
+                self.save(snapshot)
+                last_saved_at = time.time()
+
+            time.sleep(max(0, options['interval'] - (time.time() - t)))
+
+        if snapshot.prices:
+            self.save(snapshot)
+
+    def save(self, snapshot: MarketSnapshot):
+        now = timezone.localtime(timezone.now())
+        snapshot.save(os.path.join(settings.BASE_DIR, 'data', 'market_watch', str(now.date()),
+                                   f'{now.strftime("%H%M%S")}.npz'))
+        http_client.log_metrics()
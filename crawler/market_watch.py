@@ -0,0 +1,100 @@
+import logging
+import math
+import os
+
+import numpy as np
+from persiantools import characters
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rows(part: str) -> list[list[str]]:
+    return [row.split(',') for row in part.split(';') if row]
+
+
+class MarketSnapshot:
+    """
+    In memory market state built from MarketWatchInit responses. The first response is a full load, the next ones
+    (requested with the heven and refid cursors) only hold changed price rows and order book rows.
+    """
+    PRICE_COLUMNS = ['heven', 'first', 'close', 'last', 'count', 'volume', 'value', 'low', 'high']
+    ORDER_BOOK_COLUMNS = ['sell_count', 'buy_count', 'buy_price', 'sell_price', 'buy_volume', 'sell_volume']
+    # full row: id, IR, ticker, description, heven, first, close, last, count, volume, value, low, high, ...
+    FULL_ROW_SIZE, FULL_ROW_TICKER, FULL_ROW_PRICES = 23, 2, slice(4, 13)
+    # delta row: id, heven, first, close, last, count, volume, value, low, high
+    DELTA_ROW_SIZE, DELTA_ROW_PRICES = 10, slice(1, 10)
+    # order book row: id, rank, sell_count, buy_count, buy_price, sell_price, buy_volume, sell_volume
+    ORDER_BOOK_ROW_SIZE, ORDER_BOOK_ROW_VALUES = 8, slice(2, 8)
+
+    def __init__(self):
+        self.tickers: dict[int, str] = {}
+        self.prices: dict[int, list[float]] = {}
+        self.order_book: dict[tuple[int, int], list[int]] = {}
+        self.heven: int = 0
+        self.refid: int = 0
+
+    @staticmethod
+    def parse_price_row(row: list[str]) -> tuple[int, str | None, list[float]] | None:
+        """Share id, ticker (of full rows only) and prices of a price row, None for rows of other layouts."""
+        if len(row) >= MarketSnapshot.FULL_ROW_SIZE:
+            share_id, ticker = int(row[0]), characters.ar_to_fa(row[MarketSnapshot.FULL_ROW_TICKER]).strip()
+            prices = list(map(float, row[MarketSnapshot.FULL_ROW_PRICES]))
+        elif len(row) == MarketSnapshot.DELTA_ROW_SIZE:
+            share_id, ticker, prices = int(row[0]), None, list(map(float, row[MarketSnapshot.DELTA_ROW_PRICES]))
+        else:
+            return None
+
+        if not all(map(math.isfinite, prices)):
+            raise ValueError(f"prices of {share_id} are not finite")
+        return share_id, ticker, prices
+
+    @staticmethod
+    def parse_order_book_row(row: list[str]) -> tuple[tuple[int, int], list[int]]:
+        if len(row) < MarketSnapshot.ORDER_BOOK_ROW_SIZE:
+            raise ValueError(f"order book row of {len(row)} columns")
+        return (int(row[0]), int(row[1])), list(map(int, row[MarketSnapshot.ORDER_BOOK_ROW_VALUES]))
+
+    def apply(self, text: str) -> int:
+        """
+        Applies a response as a whole, malformed rows are logged and skipped and the cursors move only after all
+        rows are applied.
+        """
+        parts = text.split('@')
+        if len(parts) < 5:
+            raise ValueError(f"unexpected market watch response {text[:100]}")
+        refid = int(parts[4]) if parts[4].strip() else self.refid
+
+        price_rows, order_book_rows = [], []
+        for parse, rows, parsed in [(MarketSnapshot.parse_price_row, parts[2], price_rows),
+                                    (MarketSnapshot.parse_order_book_row, parts[3], order_book_rows)]:
+            for row in parse_rows(rows):
+                try:
+                    if (values := parse(row)) is not None:
+                        parsed.append(values)
+                except (ValueError, IndexError):
+                    logger.warning(f"skipped malformed market watch row {row}")
+
+        for share_id, ticker, prices in price_rows:
+            if ticker is not None:
+                self.tickers[share_id] = ticker
+            self.prices[share_id] = prices
+        self.order_book.update(order_book_rows)
+
+        self.heven = max([self.heven] + [int(prices[0]) for _, _, prices in price_rows])
+        self.refid = max(self.refid, refid)
+        return len(price_rows) + len(order_book_rows)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        price_ids = np.fromiter(self.prices.keys(), dtype=np.int64, count=len(self.prices))
+        order_keys = np.array(list(self.order_book.keys()), dtype=np.int64).reshape(-1, 2)
+        np.savez_compressed(path, price_ids=price_ids,
+                            prices=np.array(list(self.prices.values()), dtype=np.float64).reshape(-1, len(
+                                MarketSnapshot.PRICE_COLUMNS)),
+                            order_book_keys=order_keys,
+                            order_book=np.array(list(self.order_book.values()), dtype=np.int64).reshape(-1, len(
+                                MarketSnapshot.ORDER_BOOK_COLUMNS)),
+                            cursor=np.array([self.heven, self.refid], dtype=np.int64))
+
+        logger.info(f"market snapshot of {len(self.prices)} instruments saved in {path}")
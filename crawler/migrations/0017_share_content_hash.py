@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0016_share_identity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='share',
+            name='extra_data_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='share',
+            name='identity_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
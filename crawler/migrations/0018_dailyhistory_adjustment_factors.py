@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0017_share_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailyhistory',
+            name='scale_factor',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dailyhistory',
+            name='shift_factor',
+            field=models.FloatField(null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-18 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0018_dailyhistory_adjustment_factors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_date', models.DateField()),
+                ('last_date', models.DateField(db_index=True)),
+                ('size', models.IntegerField()),
+                ('last_history', models.JSONField()),
+                ('trade_values', models.JSONField()),
+                ('contract', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='crawler.contract')),
+                ('share', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='crawler.share')),
+            ],
+            options={
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('contract__isnull', True), ('share__isnull', False)), models.Q(('contract__isnull', False), ('share__isnull', True)), _connector='OR'), name='asset_summary_share_contract_exclusion')],
+            },
+        ),
+    ]
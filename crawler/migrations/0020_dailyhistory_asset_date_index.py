@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0019_asset_summary'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='dailyhistory',
+            name='daily_history_date_share_unique',
+        ),
+        migrations.RemoveConstraint(
+            model_name='dailyhistory',
+            name='daily_history_date_contract_unique',
+        ),
+        migrations.AlterField(
+            model_name='dailyhistory',
+            name='contract',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='history', to='crawler.contract'),
+        ),
+        migrations.AlterField(
+            model_name='dailyhistory',
+            name='share',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='history', to='crawler.share'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyhistory',
+            constraint=models.UniqueConstraint(fields=('share', 'date'), name='daily_history_share_date_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyhistory',
+            constraint=models.UniqueConstraint(fields=('contract', 'date'), name='daily_history_contract_date_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0020_dailyhistory_asset_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assetsummary',
+            name='indicators',
+            field=models.JSONField(default=dict),
+        ),
+    ]
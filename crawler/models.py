@@ -1,5 +1,6 @@
 import logging
 import re
+from collections import defaultdict
 from datetime import timedelta, date
 from statistics import mean, median
 from string import digits
@@ -7,11 +8,15 @@ from typing import Any
 
 from cachetools import cached, TTLCache
 from django.db import models
-from django.db.models import Q
+from django.db.models import Q, Max, Min, Count
 from django.db.models.constraints import UniqueConstraint, CheckConstraint
 from django.utils.functional import cached_property
 from django_pandas.managers import DataFrameManager
 
+from crawler.history_cache import history_cache
+from crawler.history_panel import HistoryPanel
+from crawler.history_store import history_store, HistoryStore
+from crawler.indicators import MACD
 from crawler.time_helper import convert_date_string_to_date
 
 logger = logging.getLogger(__name__)
@@ -34,47 +39,108 @@ class HistoryHandler:
     def get_today_new(day_offset: int = DAY_OFFSET_DEFAULT):
         return date.today() - timedelta(days=day_offset)
 
-    @cached(cache=TTLCache(maxsize=10 ** 5, ttl=60 * 60))
+    @history_cache.cached
     def raw_daily_history(self):
+        if (panel := HistoryPanel.get_active(self)) is not None:
+            return panel.get_dataframe(self)
+
+        if history_store.enabled:
+            df = history_store.read_dataframe(self)
+            if df is not None:
+                return df
+
         return self.history.all().order_by('date').to_dataframe(
-            ['date', 'first', 'high', 'low', 'last', 'volume', 'value', 'open', 'close'])
+            ['date', 'first', 'high', 'low', 'last', 'volume', 'value', 'open', 'close', 'scale_factor',
+             'shift_factor'])
 
-    @cached(cache=TTLCache(maxsize=10 ** 5, ttl=60 * 60))
+    @history_cache.cached
     def daily_history(self, day_offset: int = DAY_OFFSET_DEFAULT, normalize_strategy: str = 'scaler'):
         assert normalize_strategy in {'scaler', 'linear'}
         df = self.raw_daily_history().copy()
         df = df[df['date'] <= Share.get_today_new(day_offset)]
+        if df.shape[0] == 0:
+            return df
+
+        if df['scale_factor'].isna().any():
+            # factors of histories stored before they were persisted
+            df['scale_factor'] = (df['close'].shift(1) / df['open'].where(df['open'] != 0)).fillna(1).cumprod()
+            df['shift_factor'] = (df['close'].shift(1) - df['open']).fillna(0).cumsum()
+
         if normalize_strategy == 'scaler':
-            df['diff'] = df['close'] / df['open'].shift(-1)
-            if df.shape[0] > 0:
-                df.loc[df.shape[0] - 1, 'diff'] = 1
-                assert (df.iloc[-1]['diff'] == 1)
-
-                df['acc_diff'] = df['diff'][::-1].cumprod()[::-1]
-                df['last'] /= df['acc_diff']
-                df['first'] /= df['acc_diff']
-                df['high'] /= df['acc_diff']
-                df['low'] /= df['acc_diff']
-                df['close'] /= df['acc_diff']
-                df['open'] /= df['acc_diff']
+            df['acc_diff'] = df['scale_factor'].iloc[-1] / df['scale_factor']
+            for column in ['last', 'first', 'high', 'low', 'close', 'open']:
+                df[column] /= df['acc_diff']
         else:
-            df['diff'] = df['close'] - df['open'].shift(-1)
-            if df.shape[0] > 0:
-                df.loc[df.shape[0] - 1, 'diff'] = 0
-                assert (df.iloc[-1]['diff'] == 0)
-
-                df['acc_diff'] = df['diff'][::-1].cumsum()[::-1]
-                df['last'] -= df['acc_diff']
-                df['first'] -= df['acc_diff']
-                df['high'] -= df['acc_diff']
-                df['low'] -= df['acc_diff']
-                df['close'] -= df['acc_diff']
-                df['open'] -= df['acc_diff']
+            df['acc_diff'] = df['shift_factor'].iloc[-1] - df['shift_factor']
+            for column in ['last', 'first', 'high', 'low', 'close', 'open']:
+                df[column] -= df['acc_diff']
 
         return df
 
-    @cached(cache=TTLCache(maxsize=10 ** 5, ttl=24 * 60 * 60))
+    @staticmethod
+    def compute_adjustment_factors(histories: list['DailyHistory'], previous: tuple | None = None):
+        """
+        Sets forward cumulative adjustment factors of histories (sorted by date) following the previous (close,
+        scale_factor, shift_factor). A price adjusted to a later day is price * scale_factor / scale_factor of that
+        day for the scaler strategy and price + shift_factor - shift_factor of that day for the linear one.
+        """
+        close, scale_factor, shift_factor = previous if previous is not None else (None, 1.0, 0.0)
+        for history in histories:
+            if close is not None:
+                shift_factor += close - history.open
+                if history.open:
+                    scale_factor *= close / history.open
+
+            history.scale_factor, history.shift_factor = scale_factor, shift_factor
+            close = history.close
+
+    def get_previous_factors(self, d: date) -> tuple | None:
+        return self.history.filter(date__lt=d).order_by('-date').values_list(
+            'close', 'scale_factor', 'shift_factor').first()
+
+    def set_adjustment_factors(self, histories: list['DailyHistory']) -> bool:
+        """Sets factors of new histories appended after the stored ones, False if factors of those are missing."""
+        previous = self.get_previous_factors(histories[0].date)
+        if previous is not None and previous[1] is None:
+            return False
+
+        HistoryHandler.compute_adjustment_factors(histories, previous)
+        return True
+
+    def update_adjustment_factors(self, from_date: date | None = None, batch_size: int = 100) -> int:
+        """Recomputes factors of stored histories from a date on, only changed histories are written."""
+        previous = self.get_previous_factors(from_date) if from_date is not None else None
+        if previous is not None and previous[1] is None:
+            return self.update_adjustment_factors(batch_size=batch_size)
+
+        histories = self.history.all() if from_date is None else self.history.filter(date__gte=from_date)
+        histories = list(histories.order_by('date').only('date', 'open', 'close', 'scale_factor', 'shift_factor'))
+        factors = [(history.scale_factor, history.shift_factor) for history in histories]
+        HistoryHandler.compute_adjustment_factors(histories, previous)
+
+        changed = [history for history, old in zip(histories, factors) if
+                   old != (history.scale_factor, history.shift_factor)]
+        DailyHistory.objects.bulk_update(changed, ['scale_factor', 'shift_factor'], batch_size=batch_size)
+        return len(changed)
+
+    def get_summary(self, day_offset: int | None = DAY_OFFSET_DEFAULT) -> 'AssetSummary | None':
+        """Summary of the asset, for a day offset only if none of its histories is after that day."""
+        try:
+            summary = self.summary
+        except AssetSummary.DoesNotExist:
+            return None
+
+        return summary if day_offset is None or summary.last_date <= Share.get_today_new(day_offset) else None
+
+    @history_cache.cached
     def get_first_date_of_history(self):
+        if (panel := HistoryPanel.get_active(self)) is not None:
+            array = panel.get_array(self, Share.get_today_new())
+            return HistoryPanel.to_record(array, 0)['date'] if array.shape[1] > 0 else Share.get_today_new()
+
+        if (summary := self.get_summary()) is not None:
+            return summary.first_date
+
         if self.history_size() > 0:
             return self.history.all().filter(date__lte=Share.get_today_new()).earliest('date').date
         else:
@@ -87,19 +153,44 @@ class HistoryHandler:
         daily_history = self.daily_history(day_offset, normalize_strategy)
         return daily_history[daily_history['date'] <= d].iloc[-1]
 
-    @cached(cache=TTLCache(maxsize=10 ** 5, ttl=60 * 60))
+    @history_cache.cached
     def last_day_history(self, day_offset: int = DAY_OFFSET_DEFAULT):
+        if (panel := HistoryPanel.get_active(self)) is not None:
+            array = panel.get_array(self, Share.get_today_new(day_offset))
+            if array.shape[1] == 0:
+                raise DailyHistory.DoesNotExist()
+            return HistoryPanel.to_record(array, -1)
+
+        if (summary := self.get_summary(day_offset)) is not None:
+            return {'date': summary.last_date, **summary.last_history}
+
         return self.history.all().filter(date__lte=Share.get_today_new(day_offset)).latest('date').__dict__
 
-    @cached(cache=TTLCache(maxsize=10 ** 5, ttl=60 * 60))
+    @history_cache.cached
     def history_size(self, day_offset: int = DAY_OFFSET_DEFAULT) -> int:
+        if (panel := HistoryPanel.get_active(self)) is not None:
+            return panel.get_array(self, Share.get_today_new(day_offset)).shape[1]
+
+        if (summary := self.get_summary(day_offset)) is not None:
+            return summary.size
+
         return self.history.all().filter(date__lte=Share.get_today_new(day_offset)).count()
 
-    @cached(cache=TTLCache(maxsize=10 ** 5, ttl=60 * 60))
+    @history_cache.cached
     def get_average_trade_value(self, days: int) -> tuple[float, float]:
         if self.history_size() == 0:
             return 0, 0
 
+        if (panel := HistoryPanel.get_active(self)) is not None:
+            histories = panel.get_array(self, Share.get_today_new())[HistoryStore.COLUMNS.index('value') + 1,
+                                                                    -days:].tolist()
+            return mean(histories), median(histories)
+
+        if (summary := self.get_summary()) is not None and (
+                days <= len(summary.trade_values) or len(summary.trade_values) == summary.size):
+            histories = summary.trade_values[-days:]
+            return mean(histories), median(histories)
+
         histories = list(self.history.all().filter(date__lte=Share.get_today_new()).order_by('date')[
                              max(self.history_size() - days, 0):].values_list('value', flat=True))
 
@@ -182,7 +273,9 @@ class Share(models.Model, HistoryHandler):
     eps = models.IntegerField(null=True, blank=False)
     last_update = models.DateTimeField(null=True)
     extra_data = models.JSONField(null=True, blank=False)
+    extra_data_hash = models.CharField(null=True, blank=False, max_length=64)
     identity = models.JSONField(null=True, blank=False)
+    identity_hash = models.CharField(null=True, blank=False, max_length=64)
 
     def compute_value(self, count, price):
         # logger.info(f'{self.group.id}, {count}, {price}')
@@ -212,7 +305,8 @@ class Share(models.Model, HistoryHandler):
 
         return count * price * (1 + ratio)
 
-    def parse_data(self):
+    def parse_data(self, index: 'ShareIndex | None' = None):
+        index = index or DatabaseShareIndex()
         try:
             if self.is_buy_option or self.is_sell_option or 'اختیار' in self.description:
                 parts = self.description.split('-')
@@ -249,12 +343,12 @@ class Share(models.Model, HistoryHandler):
                 }
                 for ticker in [ticker_parts[-2] + ' ' + ticker_parts[-1], ticker_parts[-1]]:
                     ticker = dictionary.get(ticker, ticker)
-                    candidates = [candidate for candidate in Share.objects.filter(ticker=ticker) if
-                                  candidate.history_size() > 0]
+                    candidates = [candidate for candidate in index.get_shares(ticker) if
+                                  index.get_last_date(candidate)]
                     if len(candidates) == 0:
                         continue
                     elif len(candidates) > 1:
-                        candidates = sorted(candidates, key=lambda candidate: candidate.last_day_history()['date'],
+                        candidates = sorted(candidates, key=lambda candidate: index.get_last_date(candidate),
                                             reverse=True)
 
                     if parts[1]:
@@ -269,10 +363,7 @@ class Share(models.Model, HistoryHandler):
             elif self.is_bond and self.identity and int(self.identity['subSector']['cSoSecVal']) == 6940:
                 return convert_date_string_to_date(re.findall(r'\d+$', self.description)[0]), None, None
             elif self.is_rights_issue and self.identity:
-                if Share.objects.filter(enable=True, ticker=self.ticker[:-1]).exists():
-                    candidates = Share.objects.filter(enable=True, ticker=self.ticker[:-1])
-                else:
-                    candidates = Share.objects.filter(ticker=self.ticker[:-1])
+                candidates = index.get_shares(self.ticker[:-1], enable=True) or index.get_shares(self.ticker[:-1])
 
                 if len(candidates) == 0:
                     if self.enable:
@@ -281,12 +372,12 @@ class Share(models.Model, HistoryHandler):
                 elif len(candidates) > 1:
                     candidates = sorted(candidates, reverse=True,
                                         key=lambda s: (
-                                            s.last_day_history()['date'] if s.history_size() > 0 else Share.BASE_DATE,
+                                            index.get_last_date(s) or Share.BASE_DATE,
                                             s.identity['cSocCSAC'] == self.identity['cSocCSAC']))
 
                 return None, None, candidates[0]
             elif self.ticker[-1].isdigit() and self.identity:
-                candidates = Share.objects.filter(enable=True, ticker=self.ticker.rstrip(digits))
+                candidates = index.get_shares(self.ticker.rstrip(digits), enable=True)
                 candidates = [candidate for candidate in candidates if candidate.identity and
                               candidate.identity['cSocCSAC'] == self.identity['cSocCSAC']]
 
@@ -294,8 +385,7 @@ class Share(models.Model, HistoryHandler):
                     return None, None, None
                 elif len(candidates) > 1:
                     candidates = sorted(candidates, reverse=True,
-                                        key=lambda s: s.last_day_history()[
-                                            'date'] if s.history_size() > 0 else Share.BASE_DATE)
+                                        key=lambda s: index.get_last_date(s) or Share.BASE_DATE)
 
                 return None, None, candidates[0]
             else:
@@ -334,8 +424,11 @@ class Share(models.Model, HistoryHandler):
 
 
 class DailyHistory(models.Model):
-    share = models.ForeignKey(Share, null=True, blank=True, on_delete=models.CASCADE, related_name="history")
-    contract = models.ForeignKey(Contract, null=True, blank=True, on_delete=models.CASCADE, related_name="history")
+    # indexed by the (asset, date) unique constraints
+    share = models.ForeignKey(Share, null=True, blank=True, on_delete=models.CASCADE, related_name="history",
+                              db_index=False)
+    contract = models.ForeignKey(Contract, null=True, blank=True, on_delete=models.CASCADE, related_name="history",
+                                 db_index=False)
     date = models.DateField(null=False, blank=False, db_index=True)
 
     first = models.IntegerField(null=False, blank=False)
@@ -350,6 +443,9 @@ class DailyHistory(models.Model):
     count = models.BigIntegerField(null=False, blank=False)
     value = models.BigIntegerField(null=False, blank=False)
 
+    scale_factor = models.FloatField(null=True, blank=False)
+    shift_factor = models.FloatField(null=True, blank=False)
+
     objects = DataFrameManager()
 
     @cached_property
@@ -358,15 +454,14 @@ class DailyHistory(models.Model):
 
     class Meta:
         constraints = [
+            # asset first, so the indexes serve the per asset range reads and are targets of upserts
             UniqueConstraint(
-                fields=['date', 'share'],
-                condition=Q(share__isnull=False),
-                name='daily_history_date_share_unique'
+                fields=['share', 'date'],
+                name='daily_history_share_date_unique'
             ),
             UniqueConstraint(
-                fields=['date', 'contract'],
-                condition=Q(contract__isnull=False),
-                name='daily_history_date_contract_unique'
+                fields=['contract', 'date'],
+                name='daily_history_contract_date_unique'
             ),
             CheckConstraint(
                 condition=(
@@ -379,3 +474,116 @@ class DailyHistory(models.Model):
 
     def __str__(self):
         return f"{self.asset}: {self.date}"
+
+
+class AssetSummary(models.Model):
+    """
+    First and last date, size, last history, recent trade values and indicator states of an asset, maintained at
+    ingest.
+    """
+    TRADE_VALUES_SIZE = 250
+    INDICATORS = [MACD()]
+
+    share = models.OneToOneField(Share, null=True, blank=True, on_delete=models.CASCADE, related_name="summary")
+    contract = models.OneToOneField(Contract, null=True, blank=True, on_delete=models.CASCADE, related_name="summary")
+
+    first_date = models.DateField(null=False, blank=False)
+    last_date = models.DateField(null=False, blank=False, db_index=True)
+    size = models.IntegerField(null=False, blank=False)
+    last_history = models.JSONField(null=False, blank=False)
+    trade_values = models.JSONField(null=False, blank=False)
+    indicators = models.JSONField(null=False, blank=False, default=dict)
+
+    def add_histories(self, histories: list[DailyHistory]):
+        """Moves the summary forward to the last of the histories (sorted by date)."""
+        self.last_date = histories[-1].date
+        self.last_history = {column: getattr(histories[-1], column) for column in HistoryStore.COLUMNS}
+        self.trade_values = (self.trade_values + [history.value for history in histories])[
+                            -AssetSummary.TRADE_VALUES_SIZE:]
+
+        indicators = {}
+        for indicator in AssetSummary.INDICATORS:
+            state = self.indicators.get(indicator.name)
+            if state is not None and all(history.scale_factor is not None for history in histories):
+                state = indicator.update(state, [(history.date, history.close, history.scale_factor) for history in
+                                                 histories])
+                if state is not None:
+                    indicators[indicator.name] = state
+        self.indicators = indicators
+
+    @staticmethod
+    def compute_indicators(asset) -> dict:
+        """Indicator states over all stored histories of an asset."""
+        df = asset.history.all().order_by('date').to_dataframe(['date', 'close', 'open', 'scale_factor'])
+        if df['scale_factor'].isna().any():
+            df['scale_factor'] = (df['close'].shift(1) / df['open'].where(df['open'] != 0)).fillna(1).cumprod()
+
+        states = {indicator.name: indicator.compute(df) for indicator in AssetSummary.INDICATORS}
+        return {name: state for name, state in states.items() if state is not None}
+
+    @staticmethod
+    def update_asset(asset, histories: list[DailyHistory], appended: bool = True):
+        """
+        Updates the summary of an asset after new histories (sorted by date) are stored. Appended histories are added
+        to the summary, otherwise it is rebuilt from the stored histories (as adjustment factors may have changed).
+        """
+        summary = asset.get_summary(None)
+        rebuilt = summary is None or not appended
+        if rebuilt:
+            histories = list(asset.history.order_by('-date')[:AssetSummary.TRADE_VALUES_SIZE])[::-1]
+            if not histories:
+                return
+
+            summary = AssetSummary(pk=summary.pk if summary else None, trade_values=[],
+                                   **{asset._meta.get_field('history').field.name: asset},
+                                   **asset.history.aggregate(first_date=Min('date'), size=Count('id')))
+        else:
+            summary.size += len(histories)
+
+        summary.add_histories(histories)
+        if rebuilt:
+            summary.indicators = AssetSummary.compute_indicators(asset)
+        summary.save()
+        asset.summary = summary
+
+    class Meta:
+        constraints = [
+            CheckConstraint(
+                condition=(
+                        Q(share__isnull=False, contract__isnull=True) |
+                        Q(share__isnull=True, contract__isnull=False)
+                ),
+                name='asset_summary_share_contract_exclusion'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.share if self.share_id else self.contract}: {self.first_date} - {self.last_date}"
+
+
+class DatabaseShareIndex:
+    def get_shares(self, ticker: str, enable: bool | None = None) -> list[Share]:
+        shares = Share.objects.filter(ticker=ticker)
+        return list(shares.filter(enable=enable) if enable is not None else shares)
+
+    def get_last_date(self, share: Share) -> date | None:
+        return share.last_day_history()['date'] if share.history_size() > 0 else None
+
+
+class ShareIndex(DatabaseShareIndex):
+    """In memory lookup of shares by ticker and of their last history date, built with two queries."""
+
+    def __init__(self, shares=None):
+        self.shares_by_ticker: dict[str, list[Share]] = defaultdict(list)
+        for share in Share.objects.all() if shares is None else shares:
+            self.shares_by_ticker[share.ticker].append(share)
+
+        self.last_dates: dict[int, date] = dict(
+            DailyHistory.objects.filter(share__isnull=False, date__lte=Share.get_today_new()).values(
+                'share_id').annotate(last_date=Max('date')).values_list('share_id', 'last_date'))
+
+    def get_shares(self, ticker: str, enable: bool | None = None) -> list[Share]:
+        return [share for share in self.shares_by_ticker.get(ticker, []) if enable is None or share.enable == enable]
+
+    def get_last_date(self, share: Share) -> date | None:
+        return self.last_dates.get(share.id)
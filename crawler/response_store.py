@@ -0,0 +1,84 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from datetime import date
+
+
+class ResponseNotRecorded(Exception):
+    pass
+
+
+class ResponseStore:
+    """
+    Compressed on-disk http responses, content addressed by method, url, params and body of the request. The day of
+    the capture is kept with them, replays take it as today so requests planned by date are the recorded ones.
+    """
+    OFF, RECORD, REPLAY = 'off', 'record', 'replay'
+    CAPTURE_FILE = 'capture.json'
+
+    def __init__(self, path: str, mode: str = OFF):
+        assert mode in {ResponseStore.OFF, ResponseStore.RECORD, ResponseStore.REPLAY}
+        self.path = path
+        self.mode = mode
+        self.capture_date: date | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != ResponseStore.OFF
+
+    def get_today(self) -> date:
+        """Day of the capture while replaying, the current day otherwise."""
+        if self.mode != ResponseStore.REPLAY:
+            return date.today()
+
+        if self.capture_date is None:
+            file_path = os.path.join(self.path, ResponseStore.CAPTURE_FILE)
+            if not os.path.exists(file_path):
+                raise ResponseNotRecorded(f"no capture in {self.path}")
+            with open(file_path) as f:
+                self.capture_date = date.fromisoformat(json.load(f)['date'])
+        return self.capture_date
+
+    def save_capture_date(self):
+        if self.capture_date == date.today():
+            return
+
+        self.capture_date = date.today()
+        os.makedirs(self.path, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=self.path, delete=False) as f:
+            json.dump({'date': self.capture_date.isoformat()}, f)
+        os.replace(f.name, os.path.join(self.path, ResponseStore.CAPTURE_FILE))
+
+    @staticmethod
+    def get_key(method: str, url: str, params=None, data=None) -> str:
+        if isinstance(params, dict):
+            params = list(params.items())
+        request = [method.upper(), url, [list(map(str, param)) for param in params or []], data]
+        return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    def get_file_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f'{key}.json.gz')
+
+    def save(self, method: str, url: str, params, data, status_code: int, content: bytes, encoding: str | None):
+        self.save_capture_date()
+        key = self.get_key(method, url, params, data)
+        file_path = self.get_file_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        record = {'method': method.upper(), 'url': url, 'status_code': status_code, 'encoding': encoding,
+                  'content': base64.b64encode(content).decode()}
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(file_path), delete=False) as f:
+            f.write(gzip.compress(json.dumps(record).encode()))
+        os.replace(f.name, file_path)
+
+    def load(self, method: str, url: str, params=None, data=None) -> tuple[int, bytes, str | None]:
+        file_path = self.get_file_path(self.get_key(method, url, params, data))
+        if not os.path.exists(file_path):
+            raise ResponseNotRecorded(f"{method.upper()} {url} {params} {data} is not recorded")
+
+        with open(file_path, 'rb') as f:
+            record = json.loads(gzip.decompress(f.read()))
+        return record['status_code'], base64.b64decode(record['content']), record['encoding']
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import logging
+from collections import Counter
+from datetime import timedelta
+from functools import partial
+
+from django.core.cache import cache
+from django.utils import timezone
+from persiantools import characters
+
+from crawler.helper import run_jobs, search_instruments, save_search_result
+
+logger = logging.getLogger(__name__)
+
+PERSIAN_CHARS = ["آ", "ا", "ب", "ت", "ث", "ج", "ح", "خ", "د", "ذ", "ر", "ز", "س", "ش", "ص", "ض", "ط", "ظ", "ع", "غ",
+                 "ف", "ق", "ل", "م", "ن", "ه", "و", "پ", "چ", "ژ", "ک", "گ", "ی"]
+
+
+def get_fingerprint(rows: list[dict]) -> str:
+    return hashlib.sha1(json.dumps(rows, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+class ShareSearchCrawler:
+    """
+    Trie driven crawl of the instrument search from one letter prefixes. A prefix is expanded only when its result
+    looks truncated. Results are cached between runs with their fingerprint, so a prefix is searched again only when
+    its cached result is older than refresh_days or the number of known tickers containing it changed, the children
+    of truncated prefixes are visited either way.
+    """
+    CACHE_KEY = 'share_search_fingerprints'
+
+    def __init__(self, tickers: set[str], alphabet: list[str] = PERSIAN_CHARS, result_limit: int = 30,
+                 max_depth: int = 4, refresh_days: int = 7, adaptive: bool = False):
+        self.alphabet = alphabet
+        self.result_limit = result_limit
+        self.max_depth = max_depth
+        self.refresh_days = refresh_days
+        self.adaptive = adaptive
+
+        self.ticker_index = Counter(substring for ticker in tickers for substring in
+                                    {ticker[i:j] for i in range(len(ticker))
+                                     for j in range(i + 1, min(i + max_depth, len(ticker)) + 1)})
+        self.results: dict[str, list[dict]] = {}
+        self.changed: set[str] = set()
+        self.covered: set[str] = set()
+        self.visited: set[str] = set()
+        self.fingerprints: dict[str, dict] = {}
+
+    def search(self, keyword: str, cached: dict | None):
+        rows = search_instruments(keyword)
+        self.results[keyword] = rows
+
+        if not cached or cached['fingerprint'] != get_fingerprint(rows):
+            save_search_result(keyword, rows)
+            self.changed.add(keyword)
+
+    def is_fresh(self, keyword: str) -> bool:
+        cached = self.fingerprints.get(keyword)
+        return cached is not None and cached.get('known') == self.ticker_index[keyword] and \
+            cached['crawled_at'] >= timezone.now() - timedelta(days=self.refresh_days)
+
+    def is_truncated(self, keyword: str) -> bool:
+        return len(self.results[keyword]) >= self.result_limit or self.ticker_index[keyword] > self.result_limit
+
+    def get_tickers(self, keyword: str) -> list[str]:
+        return [characters.ar_to_fa(str(row['lVal18AFC'])).strip() for row in self.results[keyword]]
+
+    def crawl_keywords(self, title: str, keywords: list[str]) -> list[str]:
+        """Searches the keywords without a fresh cached result, returns the keywords whose result is truncated."""
+        stale = [keyword for keyword in keywords if not self.is_fresh(keyword)]
+        jobs = [partial(self.search, keyword, self.fingerprints.get(keyword)) for keyword in stale]
+        run_jobs(title, jobs, log=True, log_exception_on_failure=False, adaptive=self.adaptive)
+
+        self.fingerprints.update({keyword: {'fingerprint': get_fingerprint(self.results[keyword]),
+                                            'crawled_at': timezone.now(),
+                                            'truncated': self.is_truncated(keyword),
+                                            'tickers': self.get_tickers(keyword),
+                                            'known': self.ticker_index[keyword]}
+                                  for keyword in stale if keyword in self.results})
+
+        # failed searches fall back to the result of the last run
+        truncated = []
+        for keyword in keywords:
+            if keyword not in self.fingerprints:
+                continue
+
+            self.visited.add(keyword)
+            if self.fingerprints[keyword]['truncated']:
+                truncated.append(keyword)
+            else:
+                self.covered.update(self.fingerprints[keyword]['tickers'])
+        return truncated
+
+    def expand(self, keywords: list[str]) -> list[str]:
+        return [keyword + char for keyword in keywords if len(keyword) < self.max_depth for char in self.alphabet]
+
+    def crawl(self, keywords: set[str]):
+        self.fingerprints = cache.get(ShareSearchCrawler.CACHE_KEY, {})
+
+        level = self.expand([''])
+        while level:
+            level = self.expand(self.crawl_keywords(f"Update Share List by Search ({len(level[0])} chars)", level))
+
+        keywords = sorted(keywords - self.covered - self.visited)
+        logger.info(f"search for {len(keywords)} ticker names not covered by {len(self.visited)} prefixes")
+        self.crawl_keywords("Update Share List by Search (tickers)", keywords)
+        cache.set(ShareSearchCrawler.CACHE_KEY, self.fingerprints, timeout=None)
+
+        logger.info(f"share search visited {len(self.visited)} keywords, searched {len(self.results)}, "
+                    f"{len(self.changed)} changed.")
@@ -1 +1,701 @@
-# Create your tests here.
+import json
+import math
+import random
+import tempfile
+import time
+from datetime import date, timedelta, datetime, timezone
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import requests
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from tenacity import wait_fixed
+
+from crawler.analyzers import *
+from crawler.analyzers.market_panel import MarketPanel
+from crawler.analyzers.option_chain import OptionChain
+from crawler.analyzers.timeline import AssetTimeline
+from crawler.helper import update_share_history_item, update_contract_history_item, plan_share_history, \
+    plan_contract_history, submit_request, run_jobs, wait_for_circuit, update_share_identity, update_share_list, \
+    get_contract_history_windows, probe_contract_history_windows
+from crawler.history_cache import history_cache
+from crawler.history_panel import HistoryPanel
+from crawler.history_store import HistoryStore
+from crawler.http_client import HttpClient, CircuitBreaker, http_client
+from crawler.management.commands.daily_analyze import Command as DailyAnalyzeCommand
+from crawler.market_watch import MarketSnapshot
+from crawler.models import Share, Contract, DailyHistory, AssetSummary, ShareGroup
+from crawler.response_store import ResponseStore
+from crawler.share_search import ShareSearchCrawler
+from crawler.time_helper import is_trading_day, count_trading_days, get_last_session_date
+
+
+def share_history_response(days: int, start: date = date(2024, 1, 1)) -> dict:
+    rows = []
+    for offset in reversed(range(days)):
+        day = start + timedelta(days=offset)
+        rows.append({'dEven': day.year * 10000 + day.month * 100 + day.day, 'priceMax': 110, 'priceMin': 90,
+                     'pClosing': 100, 'priceYesterday': 95, 'priceChange': 5, 'priceFirst': 96, 'qTotCap': 10 ** 9,
+                     'qTotTran5J': 10 ** 5, 'zTotTran': 10})
+    return {'closingPriceDaily': rows}
+
+
+def contract_history_response(days: int, start: date = date(2024, 1, 1)) -> dict:
+    rows = []
+    for offset in reversed(range(days)):
+        rows.append({'DT': str(start + timedelta(days=offset)) + 'T12:00:00', 'MaxPrice': 110, 'MinPrice': 90,
+                     'TodaySettlementPrice': 100, 'LastPrice': 100, 'FirstPrice': 96, 'LastSettlementPrice': 95,
+                     'TradesValue': 10 ** 9, 'TradesVolume': 10 ** 5, 'C_Buy': 5, 'C_Sell': 5})
+    return {'Data': rows}
+
+
+def insert_batches(rows: int, batch_size: int = 100) -> int:
+    fields = [field for field in DailyHistory._meta.concrete_fields if not field.primary_key]
+    return math.ceil(rows / min(batch_size, connection.ops.bulk_batch_size(fields, [None] * rows)))
+
+
+def create_history(share: Share, start: date, end: date, rng: random.Random, price: int = 1000) -> list[DailyHistory]:
+    """Random walk daily histories on the trading days of a range, with capital events and buy queues."""
+    rows, day = [], start
+    while day <= end:
+        if day.weekday() not in [3, 4]:
+            open_price = price if rng.random() > 0.02 else int(price * rng.choice([0.5, 0.8]))
+            close = max(1, int(open_price * (1.05 if rng.random() < 0.05 else 1 + rng.uniform(-0.05, 0.05))))
+            last = max(1, int(open_price * (1 + rng.uniform(-0.05, 0.07))))
+            volume = rng.randint(1000, 10 ** 6) * (5 if rng.random() < 0.05 else 1)
+            rows.append(DailyHistory(share=share, date=day, first=open_price, last=last, close=close, open=open_price,
+                                     high=max(close, last, open_price) + rng.randint(0, 10),
+                                     low=max(1, min(close, last, open_price) - rng.randint(0, 10)), volume=volume,
+                                     count=rng.randint(1, 100), value=volume * close))
+            price = close
+        day += timedelta(days=1)
+    return rows
+
+
+def create_market(shares: int = 24, seed: int = 1) -> list[Share]:
+    """
+    Shares with a few hundred days of histories, some of them stored without scale factors, cheap rights issues of the
+    shares next to them, new comers and two option chains on the second share.
+    """
+    rng, today, rows = random.Random(seed), date.today(), []
+    for i in range(1, shares + 1):
+        share = Share.objects.create(id=i, ticker=f's{i}' + ('ح' if i % 6 == 1 else ''), description='d',
+                                     base_share_id=i + 1 if i % 6 == 1 and i < shares else None)
+        rows += create_history(share, today - timedelta(days=rng.randint(20, 400)),
+                               today - timedelta(days=rng.choice([0, 0, 0, 1, 2, 40])), rng,
+                               {1: 200, 2: 5000}.get(i % 6, rng.choice([200, 5000])))
+    for i in range(shares + 1, shares + 4):
+        share = Share.objects.create(id=i, ticker=f'n{i}', description='d')
+        rows += create_history(share, today - timedelta(days=rng.randint(3, 30)), today, rng)
+    for i, strike_date in enumerate([today + timedelta(days=30), today + timedelta(days=90)]):
+        for j, strike in enumerate([900, 1000, 1100, 1200, 1300]):
+            for side in OptionChain.SIDES:
+                option = Share.objects.create(id=1000 + i * 100 + j * 10 + (side == OptionChain.SIDES[1]),
+                                              ticker=f'{side}o{i}{j}', description='اختیار', base_share_id=2,
+                                              strike_date=strike_date, option_strike_price=strike)
+                rows += create_history(option, today - timedelta(days=rng.randint(5, 60)),
+                                       today - timedelta(days=rng.choice([0, 0, 1])), rng, rng.randint(50, 300))
+    DailyHistory.objects.bulk_create(rows, batch_size=1000)
+    DailyHistory.objects.filter(share_id__in=range(3, shares + 1, 5)).update(scale_factor=None)
+    return list(Share.objects.all())
+
+
+class HistoryIngestQueryCountTest(TestCase):
+    def update_share_history(self, share: Share, response: dict, **kwargs) -> int:
+        with patch('crawler.helper.submit_request') as submit_request, CaptureQueriesContext(connection) as queries:
+            submit_request.return_value.json.return_value = response
+            update_share_history_item(share, **kwargs)
+        return len(queries)
+
+    def get_writes(self, share: Share, response: dict, **kwargs) -> list[str]:
+        with CaptureQueriesContext(connection) as queries:
+            self.update_share_history(share, response, **kwargs)
+        return [query['sql'] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+
+    def update_contract_history(self, contract: Contract, response: dict) -> int:
+        with patch('crawler.helper.submit_request') as submit_request, CaptureQueriesContext(connection) as queries:
+            submit_request.return_value.json.return_value = response
+            update_contract_history_item(contract, days=30)
+        return len(queries)
+
+    def test_share_history_queries_do_not_depend_on_response_size(self):
+        small_share = Share.objects.create(id=1, ticker='small', description='small')
+        large_share = Share.objects.create(id=2, ticker='large', description='large')
+
+        small_queries = self.update_share_history(small_share, share_history_response(10))
+        large_queries = self.update_share_history(large_share, share_history_response(1000))
+
+        self.assertEqual(large_share.history.count(), 1000)
+        # only the number of insert batches (plus their savepoint) may grow with the response
+        self.assertLessEqual(large_queries, small_queries + insert_batches(1000) + 2)
+
+    def test_share_history_skips_stored_dates(self):
+        share = Share.objects.create(id=1, ticker='share', description='share')
+        self.update_share_history(share, share_history_response(500))
+
+        queries = self.update_share_history(share, share_history_response(1000))
+
+        self.assertEqual(share.history.count(), 1000)
+        self.assertLessEqual(queries, 20)
+
+    def test_share_history_revision_upserts_only_revised_rows(self):
+        share = Share.objects.create(id=1, ticker='share', description='share')
+        self.update_share_history(share, share_history_response(100))
+
+        self.assertEqual(self.get_writes(share, share_history_response(100), revision_days=100,
+                                         last_update=False), [])
+
+        response = share_history_response(100)
+        for row in response['closingPriceDaily'][:3]:
+            row['pClosing'] = 101
+        writes = self.get_writes(share, response, revision_days=100, last_update=False)
+
+        self.assertEqual(share.history.count(), 100)
+        self.assertEqual(share.history.filter(close=101).count(), 3)
+        self.assertEqual(len([write for write in writes if 'ON CONFLICT' in write]), 1)
+
+    def test_share_history_moves_indicator_state_forward(self):
+        share = Share.objects.create(id=1, ticker='share', description='share')
+        self.update_share_history(share, share_history_response(100))
+        response = share_history_response(105)
+        response['closingPriceDaily'][0]['priceYesterday'] = 50
+        self.update_share_history(share, response)
+
+        state = AssetSummary.objects.get(share=share).indicators['macd_12_26_9']
+        expected = AssetSummary.compute_indicators(share)['macd_12_26_9']
+        self.assertEqual(state['date'], expected['date'])
+        for key in ['macd', 'macds']:
+            for value, expected_value in zip(state[key], expected[key]):
+                self.assertAlmostEqual(value, expected_value)
+
+    def test_contract_history_queries_do_not_depend_on_response_size(self):
+        contract = Contract.objects.create(id=1, code='c', description='c', size=1, commodity_id=1,
+                                           commodity_name='c')
+
+        queries = self.update_contract_history(contract, contract_history_response(1000))
+        self.assertEqual(DailyHistory.objects.filter(contract=contract).count(), 1000)
+        # beside insert batches: stored dates, factors and the summary built on the first ingest of an asset
+        self.assertLessEqual(queries, 1 + insert_batches(1000) + 8)
+
+        queries = self.update_contract_history(contract, contract_history_response(1000))
+        self.assertEqual(DailyHistory.objects.filter(contract=contract).count(), 1000)
+        self.assertLessEqual(queries, 5)
+
+
+class ContractHistoryWindowTest(TestCase):
+    def setUp(self):
+        self.contract = Contract.objects.create(id=1, code='c', description='c', size=1, commodity_id=1,
+                                                commodity_name='c')
+
+    def submit_request(self, trades: list[date]):
+        """Mocked CDCTrades api serving trades on the days, newest first and paged."""
+        self.requests = []
+
+        def submit_request(method, url, data, **kwargs):
+            self.requests.append(data)
+            rows = [{'DT': f'{day}T12:00:00', 'MaxPrice': 110, 'MinPrice': 90, 'TodaySettlementPrice': 100,
+                     'LastPrice': 100, 'FirstPrice': 96, 'LastSettlementPrice': 95, 'TradesValue': 10 ** 9,
+                     'TradesVolume': 10 ** 5, 'C_Buy': 5, 'C_Sell': 5} for day in sorted(trades, reverse=True) if
+                    data['fromDate'] <= str(day) <= data['toDate']]
+            response = requests.Response()
+            response.status_code, response._content = 200, json.dumps({'Data': rows[:data['pageSize']]}).encode()
+            return response
+
+        return patch('crawler.helper.submit_request', submit_request)
+
+    def test_windows_cover_the_days(self):
+        today = date.today()
+        for days in [0, 1, 89, 90, 91, 100, 179, 180, 181, 1000]:
+            windows = get_contract_history_windows(days)
+            self.assertEqual(windows[0][1], today)
+            self.assertEqual(windows[-1][0], today - timedelta(days=days))
+            for (from_date, to_date), (next_from_date, next_to_date) in zip(windows[1:], windows):
+                self.assertEqual(to_date + timedelta(days=1), next_from_date)
+            self.assertTrue(all(0 <= (to_date - from_date).days < 90 for from_date, to_date in windows))
+
+    def test_probe_finds_the_window_of_the_oldest_trade(self):
+        windows, today = get_contract_history_windows(1000), date.today()
+        # windows are [today - 90 * i - 89, today - 90 * i]
+        for oldest, count in [(0, 1), (89, 1), (90, 2), (449, 5), (450, 6), (1000, 12)]:
+            with self.submit_request([today - timedelta(days=oldest), today - timedelta(days=oldest // 2), today]):
+                self.assertEqual(probe_contract_history_windows(self.contract, windows), count)
+            self.assertTrue(all(request['pageSize'] == 1 for request in self.requests))
+            self.assertLessEqual(len(self.requests), math.ceil(math.log2(len(windows) + 1)))
+
+        with self.submit_request([]):
+            self.assertEqual(probe_contract_history_windows(self.contract, windows), 0)
+
+    def test_history_fetched_in_windows(self):
+        today = date.today()
+        trades = [today - timedelta(days=days) for days in range(0, 700, 3)]
+        with self.submit_request(trades):
+            self.assertEqual(update_contract_history_item(self.contract, days=1000), (len(trades), 0))
+        self.assertEqual(sorted(DailyHistory.objects.filter(contract=self.contract).values_list('date', flat=True)),
+                         sorted(trades))
+
+
+class ResponseStoreReplayTest(TestCase):
+    class Upstream:
+        """Session serving 30 days of share and contract histories up to today, sliced like the apis do."""
+
+        def __init__(self):
+            self.requests = 0
+
+        def request(self, method, url, **kwargs):
+            self.requests += 1
+            start = date.today() - timedelta(days=29)
+            if 'GetClosingPriceDailyList' in url:
+                days = int(url.split('/')[-1])
+                rows = share_history_response(30, start)['closingPriceDaily']
+                content = {'closingPriceDaily': rows[:days] if days else rows}
+            else:
+                body = kwargs['json']
+                content = {'Data': [row for row in contract_history_response(30, start)['Data'] if
+                                    body['fromDate'] <= row['DT'][:10] <= body['toDate']][:body['pageSize']]}
+
+            response = requests.Response()
+            response.status_code, response._content = 200, json.dumps(content).encode()
+            return response
+
+    class LaterDate(date):
+        @classmethod
+        def today(cls):
+            return date.today() + timedelta(days=3)
+
+    def update_histories(self, store: ResponseStore, session):
+        with patch.object(http_client, 'response_store', store), patch.object(http_client, 'get_session',
+                                                                              return_value=session):
+            for share, days in plan_share_history(list(Share.objects.all())):
+                update_share_history_item(share, days=days)
+            for contract, days in plan_contract_history(list(Contract.objects.all())):
+                update_contract_history_item(contract, days=days)
+
+    def test_capture_replays_into_empty_database(self):
+        share = Share.objects.create(id=1, ticker='share', description='share')
+        contract = Contract.objects.create(id=1, code='c', description='c', size=1, commodity_id=1,
+                                           commodity_name='c')
+        for asset in [{'share': share}, {'contract': contract}]:
+            DailyHistory.objects.create(**asset, date=date.today() - timedelta(days=29), first=96, high=110, low=90,
+                                        last=100, open=95, close=100, volume=10 ** 5, value=10 ** 9, count=10)
+
+        with tempfile.TemporaryDirectory() as path:
+            self.update_histories(ResponseStore(path, ResponseStore.RECORD), ResponseStoreReplayTest.Upstream())
+            recorded = list(DailyHistory.objects.order_by('share', 'contract', 'date').values_list(
+                'share', 'contract', 'date', 'close'))
+            self.assertEqual(len(recorded), 60)
+
+            DailyHistory.objects.all().delete()
+            AssetSummary.objects.all().delete()
+            history_cache.clear()
+
+            # replayed on a later day without network
+            upstream = ResponseStoreReplayTest.Upstream()
+            with patch('crawler.helper.date', ResponseStoreReplayTest.LaterDate):
+                self.update_histories(ResponseStore(path, ResponseStore.REPLAY), upstream)
+
+        self.assertEqual(upstream.requests, 0)
+        self.assertEqual(list(DailyHistory.objects.order_by('share', 'contract', 'date').values_list(
+            'share', 'contract', 'date', 'close')), recorded)
+
+
+class HistoryPlanTest(TestCase):
+    @patch('crawler.helper.get_last_session_date', return_value=date(2024, 1, 10))
+    def test_share_history_plan(self, _):
+        new, behind, current, disabled = [Share.objects.create(id=i, ticker=str(i), description=str(i), enable=i != 4)
+                                          for i in range(1, 5)]
+        expired = Share.objects.create(id=5, ticker='5', description='5', strike_date=date(2024, 1, 5),
+                                       last_update=datetime(2024, 1, 7, 12, tzinfo=timezone.utc))
+        for share, day in [(behind, date(2024, 1, 3)), (current, date(2024, 1, 10)), (disabled, date(2024, 1, 3)),
+                           (expired, date(2024, 1, 3))]:
+            DailyHistory.objects.create(share=share, date=day, first=1, high=1, low=1, last=1, open=1, close=1,
+                                        volume=1, value=1, count=1)
+
+        shares = [new, behind, current, disabled, expired]
+        with self.assertNumQueries(1):
+            plan = plan_share_history(shares)
+        # 2024-01-04 and 2024-01-05 are Thursday and Friday
+        self.assertEqual(plan, [(new, 0), (behind, 6)])
+        self.assertEqual(plan_share_history(shares, revision_days=20), [(new, 0), (behind, 6), (current, 20)])
+
+    @override_settings(MARKET_HOLIDAYS={'JALALI': [(1, 1), (1, 2), (1, 3), (1, 4)], 'DATES': ['2024-04-10']})
+    def test_trading_calendar_skips_holidays(self):
+        # nowruz of 1403 is from 2024-03-20 to 2024-03-23
+        self.assertFalse(is_trading_day(date(2024, 3, 20)))
+        self.assertFalse(is_trading_day(date(2024, 4, 10)))
+        self.assertTrue(is_trading_day(date(2024, 3, 24)))
+        self.assertEqual(count_trading_days(date(2024, 3, 19), date(2024, 3, 24)), 1)
+        self.assertEqual(count_trading_days(date(2024, 4, 9), date(2024, 4, 14)), 2)
+
+        with patch('crawler.time_helper.timezone.now', return_value=datetime(2024, 3, 23, 16, tzinfo=timezone.utc)):
+            self.assertEqual(get_last_session_date(), date(2024, 3, 19))
+
+
+class CircuitRecoveryTest(TestCase):
+    class FlakySession:
+        """Session of a host that refuses connections until it is up."""
+
+        def __init__(self, up_at: float):
+            self.up_at = up_at
+            self.failures = 0
+
+        def request(self, method, url, **kwargs):
+            if time.time() < self.up_at:
+                self.failures += 1
+                raise requests.ConnectionError(f"{url} is down")
+
+            response = requests.Response()
+            response.status_code, response._content = 200, b'ok'
+            return response
+
+    def test_queued_jobs_succeed_after_host_recovers(self):
+        client = HttpClient()
+        client.circuit_breakers['down.test'] = CircuitBreaker('down.test', failure_threshold=3,
+                                                              recovery_timeout=0.2, probe_interval=0.05)
+        # the host is back before the circuit lets its probe through
+        session = CircuitRecoveryTest.FlakySession(time.time() + 0.1)
+        request = submit_request.retry_with(wait=wait_for_circuit(wait_fixed(0.01)))
+
+        with patch('crawler.helper.http_client', client), patch.object(client, 'get_session', return_value=session):
+            results = run_jobs('flaky host', [lambda i=i: request('get', f'http://down.test/{i}').text for i in
+                                              range(50)], max_workers=10, log=False)
+
+        self.assertEqual(results, ['ok'] * 50)
+        # the open circuit holds the queue back, only the probes reach the host while it is down
+        self.assertLess(session.failures, 20)
+        self.assertEqual(client.circuit_breakers['down.test'].state, CircuitBreaker.CLOSED)
+
+    def test_queued_jobs_fail_fast_once_probe_fails(self):
+        client, sleeps = HttpClient(), []
+        client.circuit_breakers['down.test'] = CircuitBreaker('down.test', failure_threshold=3,
+                                                              recovery_timeout=0.2, probe_interval=0.05)
+        session = CircuitRecoveryTest.FlakySession(time.time() + 3600)
+        request = submit_request.retry_with(wait=wait_for_circuit(wait_fixed(0.01)),
+                                            sleep=lambda seconds: sleeps.append(seconds) or time.sleep(seconds))
+
+        t = time.time()
+        with patch('crawler.helper.http_client', client), patch.object(client, 'get_session', return_value=session):
+            results = run_jobs('down host', [lambda i=i: request('get', f'http://down.test/{i}').text for i in
+                                             range(500)], max_workers=10, log=False)
+
+        self.assertEqual(results, [])
+        # jobs wait for the first probe at most, once it fails the rest are refused without sleeping
+        self.assertLess(time.time() - t, 2)
+        self.assertLess(len(sleeps), 200)
+        self.assertLess(session.failures, 30)
+        self.assertTrue(client.circuit_breakers['down.test'].down)
+
+
+class ConditionalRequestTest(TestCase):
+    class Upstream:
+        """Session serving an identity with an ETag, answering 304 to requests sending it back."""
+
+        def __init__(self, isin: str):
+            self.isin = isin
+            self.headers = []
+
+        def request(self, method, url, headers=None, **kwargs):
+            self.headers.append(headers or {})
+            response = requests.Response()
+            if (headers or {}).get('If-None-Match') == 'v1':
+                response.status_code, response._content = 304, b''
+            else:
+                response.status_code, response.headers['ETag'] = 200, 'v1'
+                response._content = json.dumps({'instrumentIdentity': {'instrumentID': self.isin}}).encode()
+            return response
+
+    def update_share_identity(self, client: HttpClient, upstream, share: Share) -> Share | None:
+        with patch('crawler.helper.http_client', client), patch.object(client, 'get_session', return_value=upstream):
+            return update_share_identity(share, save=False)
+
+    def test_validator_is_kept_once_the_share_is_written(self):
+        client, upstream = HttpClient(), ConditionalRequestTest.Upstream('IRO1SHARE0001')
+        share = Share.objects.create(id=1, ticker='share', description='share', isin='IRO1SHARE0001')
+
+        changed = self.update_share_identity(client, upstream, share)
+        self.assertEqual(client.validators, {})
+
+        Share.objects.bulk_update([changed], ['identity', 'identity_hash'])
+        client.commit_validators([changed.validator_key])
+        self.assertIsNone(self.update_share_identity(client, upstream, share))
+        self.assertEqual(upstream.headers[-1]['If-None-Match'], 'v1')
+
+    def test_validator_is_dropped_when_the_response_is_rejected(self):
+        client, upstream = HttpClient(), ConditionalRequestTest.Upstream('IRO1OTHER0001')
+        share = Share.objects.create(id=1, ticker='share', description='share', isin='IRO1SHARE0001')
+
+        with self.assertRaises(AssertionError):
+            self.update_share_identity(client, upstream, share)
+        self.assertEqual((client.validators, client.pending_validators), ({}, {}))
+
+        # fetched whole again by the next run
+        with self.assertRaises(AssertionError):
+            self.update_share_identity(client, upstream, Share.objects.get(id=1))
+        self.assertNotIn('If-None-Match', upstream.headers[-1])
+
+
+class ShareListTest(TestCase):
+    @staticmethod
+    def get_row(share_id: int, ticker: str, description: str) -> str:
+        return ','.join([str(share_id), 'IRO1', ticker, description] + ['1'] * 10 + ['2', '1000', '', '300', '1', '0',
+                                                                                     '0', '1000', '311'])
+
+    def test_rows_without_ticker_or_description_are_skipped(self):
+        ShareGroup.objects.create(id=1, name='group')
+        text = '@@' + ';'.join([self.get_row(1, 'share', 'share'), self.get_row(2, '', 'no ticker'),
+                                self.get_row(3, 'other', '')]) + '@@'
+        with patch('crawler.helper.get_watch_list', return_value=text), self.assertLogs('crawler.helper', 'WARNING'):
+            update_share_list()
+
+        self.assertEqual(list(Share.objects.values_list('id', 'ticker', 'description')), [(1, 'share', 'share')])
+
+
+class MarketSnapshotTest(TestCase):
+    FULL_ROW = ['1', 'IRO1SHARE0001', 'شير', 'share', '120000', '100', '101', '102', '10', '1000', '102000', '99',
+                '103'] + ['0'] * 10
+
+    @staticmethod
+    def get_response(price_rows: list[list[str]] = (), order_book_rows: list[list[str]] = (), refid: str = '') -> str:
+        return '@'.join(['', '', ';'.join(map(','.join, price_rows)), ';'.join(map(','.join, order_book_rows)), refid])
+
+    def test_full_load(self):
+        snapshot = MarketSnapshot()
+        second = ['2'] + MarketSnapshotTest.FULL_ROW[1:4] + ['121000'] + MarketSnapshotTest.FULL_ROW[5:]
+        self.assertEqual(snapshot.apply(self.get_response([MarketSnapshotTest.FULL_ROW, second], refid='7')), 2)
+
+        self.assertEqual(snapshot.tickers, {1: 'شیر', 2: 'شیر'})
+        self.assertEqual(snapshot.prices[1], [120000, 100, 101, 102, 10, 1000, 102000, 99, 103])
+        self.assertEqual((snapshot.heven, snapshot.refid), (121000, 7))
+
+    def test_delta_and_order_book_rows(self):
+        snapshot = MarketSnapshot()
+        snapshot.apply(self.get_response([MarketSnapshotTest.FULL_ROW], refid='7'))
+
+        delta = ['1', '120500', '100', '104', '105', '12', '1200', '125000', '99', '106']
+        order_book = ['1', '1', '3', '4', '104', '105', '500', '600']
+        self.assertEqual(snapshot.apply(self.get_response([delta], [order_book], refid='9')), 2)
+
+        self.assertEqual(snapshot.tickers, {1: 'شیر'})
+        self.assertEqual(snapshot.prices[1], [120500, 100, 104, 105, 12, 1200, 125000, 99, 106])
+        self.assertEqual(snapshot.order_book, {(1, 1): [3, 4, 104, 105, 500, 600]})
+        self.assertEqual((snapshot.heven, snapshot.refid), (120500, 9))
+
+    def test_malformed_rows_are_skipped(self):
+        snapshot = MarketSnapshot()
+        snapshot.apply(self.get_response([MarketSnapshotTest.FULL_ROW], refid='7'))
+
+        delta = ['1', '120500', '100', '104', '105', '12', '1200', '125000', '99', '106']
+        malformed = ['2', '130000', '', '104', '105', '12', '1200', '125000', '99', '106']
+        with self.assertLogs('crawler.market_watch', 'WARNING'):
+            updated = snapshot.apply(self.get_response([malformed, delta], [['1', '1', '3', 'x', '104', '105', '500',
+                                                                              '600']], refid='9'))
+
+        self.assertEqual(updated, 1)
+        self.assertEqual(set(snapshot.prices), {1})
+        self.assertEqual(snapshot.order_book, {})
+        self.assertEqual((snapshot.heven, snapshot.refid), (120500, 9))
+
+        # a response with a malformed cursor is not applied at all
+        with self.assertRaises(ValueError):
+            snapshot.apply(self.get_response([['1', '121000'] + delta[2:]], refid='x'))
+        self.assertEqual((snapshot.prices[1][0], snapshot.heven, snapshot.refid), (120500, 120500, 9))
+
+
+class ShareSearchCrawlerTest(TestCase):
+    LISTINGS = ['aa', 'ab', 'ac', 'ba']
+
+    def setUp(self):
+        cache.delete(ShareSearchCrawler.CACHE_KEY)
+        self.listings = list(ShareSearchCrawlerTest.LISTINGS)
+        self.searched = []
+
+    def search_instruments(self, keyword: str) -> list[dict]:
+        self.searched.append(keyword)
+        return [{'insCode': i, 'lVal18AFC': ticker} for i, ticker in enumerate(self.listings) if keyword in ticker][:3]
+
+    def crawl(self, tickers: set[str], **kwargs) -> ShareSearchCrawler:
+        self.searched = []
+        crawler = ShareSearchCrawler(tickers, alphabet=['a', 'b', 'c'], result_limit=3, max_depth=3, **kwargs)
+        with patch('crawler.share_search.search_instruments', self.search_instruments), \
+                patch('crawler.share_search.save_search_result') as save_search_result:
+            crawler.crawl(tickers)
+        self.saved = sorted(call.args[0] for call in save_search_result.call_args_list)
+        return crawler
+
+    def test_ticker_index_counts_tickers(self):
+        crawler = ShareSearchCrawler({'aba', 'bab'}, alphabet=['a', 'b'], max_depth=3)
+        self.assertEqual((crawler.ticker_index['a'], crawler.ticker_index['b'], crawler.ticker_index['ab']), (2, 2, 2))
+
+    def test_expands_truncated_prefixes(self):
+        crawler = self.crawl(set())
+        # only 'a' is in more listings than the limit
+        self.assertEqual(sorted(self.searched), ['a', 'aa', 'ab', 'ac', 'b', 'c'])
+        self.assertEqual(crawler.covered, set(self.listings))
+        self.assertEqual(self.saved, sorted(self.searched))
+
+    def test_fresh_prefixes_are_not_searched_again(self):
+        self.crawl(set(self.listings))
+        fingerprints = cache.get(ShareSearchCrawler.CACHE_KEY)
+        self.assertTrue(fingerprints['a']['truncated'])
+        self.assertFalse(fingerprints['aa']['truncated'])
+        self.assertEqual(fingerprints['b']['tickers'], ['ab', 'ba'])
+
+        crawler = self.crawl(set(self.listings))
+        self.assertEqual(self.searched, [])
+        self.assertEqual(crawler.covered, set(self.listings))
+
+    def test_new_listing_under_truncated_prefix(self):
+        self.crawl(set(self.listings))
+        self.listings.append('aaa')
+
+        # the share list knows the new ticker, prefixes containing it are searched again
+        self.crawl(set(self.listings))
+        self.assertEqual(sorted(self.searched), ['a', 'aa'])
+        self.assertEqual(self.saved, ['aa'])
+        self.assertIn('aaa', cache.get(ShareSearchCrawler.CACHE_KEY)['aa']['tickers'])
+
+    def test_stale_prefixes_are_searched_again(self):
+        self.crawl(set(self.listings))
+        self.listings.append('cc')
+
+        # the share list does not know the new ticker yet
+        crawler = self.crawl(set(self.listings[:-1]), refresh_days=0)
+        self.assertEqual(sorted(self.searched), ['a', 'aa', 'ab', 'ac', 'b', 'c'])
+        self.assertIn('cc', crawler.covered)
+        self.assertEqual(self.saved, ['c'])
+
+
+class OptionChainTest(TestCase):
+    def setUp(self):
+        self.shares = create_market()
+        self.base = Share.objects.get(id=2)
+
+    def get_mispriced(self, share: Share, day_offset: int) -> dict[str, float]:
+        """Mispriced options of the share by merging the histories of each three neighbor strikes."""
+        mispriced, options = {}, share.options.filter(enable=True)
+        for side in OptionChain.SIDES:
+            for strike_date in set(options.filter(ticker__startswith=side).values_list('strike_date', flat=True)):
+                chain = list(options.filter(ticker__startswith=side, strike_date=strike_date).order_by(
+                    'option_strike_price'))
+                for i in range(1, len(chain) - 1):
+                    df = pd.merge(chain[i + 1].daily_history(day_offset), chain[i - 1].daily_history(day_offset),
+                                  on='date', how='inner', suffixes=('_nxt', '_prv'))
+                    df = pd.merge(chain[i].daily_history(day_offset), df, on='date', how='inner')
+                    df['arbitrage'] = df['close'] / (df['close_nxt'] + df['close_prv']) * 2
+                    if df.shape[0] > 0 and df.iloc[-1]['date'] == Share.get_today_new(day_offset) and abs(
+                            1 - df.iloc[-1]['arbitrage']) > 0.1:
+                        mispriced[chain[i].ticker] = round(float(df.iloc[-1]['arbitrage']), 3)
+        return mispriced
+
+    def test_chain_matches_merged_histories(self):
+        for day_offset in range(4):
+            history_cache.clear()
+            chain = OptionChain.load([self.base], day_offset)
+            self.assertEqual(chain.get_mispriced(self.base, Share.get_today_new(day_offset)),
+                             self.get_mispriced(self.base, day_offset))
+
+            # every ratio of the matrix is the one of its strike over its neighbors on the day
+            for row in range(1, len(chain.options) - 1):
+                option, neighbors = chain.options[row], [chain.options[row - 1], chain.options[row + 1]]
+                if [other.strike_date for other in neighbors] != [option.strike_date] * 2 or \
+                        {other.ticker[0] for other in neighbors} != {option.ticker[0]}:
+                    self.assertTrue(np.isnan(chain.arbitrage[row]).all())
+                    continue
+
+                df = pd.merge(neighbors[1].daily_history(day_offset), neighbors[0].daily_history(day_offset),
+                              on='date', suffixes=('_nxt', '_prv'))
+                df = pd.merge(option.daily_history(day_offset), df, on='date')
+                cols = np.searchsorted(chain.days, [(d - HistoryStore.EPOCH).days for d in df['date']])
+                np.testing.assert_allclose(chain.arbitrage[row, cols],
+                                           df['close'] / (df['close_nxt'] + df['close_prv']) * 2)
+                self.assertEqual(np.count_nonzero(~np.isnan(chain.arbitrage[row])), len(df))
+
+    def test_timeline_signals_match_analyze(self):
+        analyzer, panel = OptionAnalyzer(gap=0.05), HistoryPanel.load(Share.objects.all())
+        timelines = {share.pk: AssetTimeline(share, panel.get_array(share)) for share in self.shares if
+                     share in panel}
+        timeline = timelines[self.base.pk]
+        signals = {HistoryStore.EPOCH + timedelta(days=int(timeline.days[loc])): payload for loc, _, payload in
+                   analyzer.get_signals(timeline, timelines)}
+
+        expected = {}
+        for day_offset in range(60):
+            history_cache.clear()
+            day = Share.get_today_new(day_offset)
+            if day in {HistoryStore.EPOCH + timedelta(days=int(d)) for d in timeline.days}:
+                result = OptionAnalyzer(gap=0.05).analyze(self.base, day_offset)
+                if result:
+                    expected[day] = result['option arbitrage']
+        # options are traded in the last 60 days only
+        self.assertTrue(expected)
+        self.assertEqual(signals, expected)
+
+
+class MarketPanelTest(TestCase):
+    def test_panel_results_match_analyze(self):
+        shares, panel = create_market(seed=2), HistoryPanel.load(Share.objects.all())
+        analyzers = [AirAnalyzer(), BuyQueueAnalyzer(), CheapRightIssueAnalyzer(), NewComerDropAnalyzer(),
+                     VolumeAnalyzer()]
+        signals = 0
+        for day_offset in [0, 1, 2, 5, 30]:
+            history_cache.clear()
+            with panel.activate():
+                traded = [share for share in shares if share.history_size(day_offset) > 0]
+                market = MarketPanel(traded, panel, day_offset)
+                for analyzer in analyzers:
+                    results = analyzer.get_results(market)
+                    self.assertEqual(results, {share.id: result for share in traded if
+                                               (result := analyzer.analyze(share, day_offset))})
+                    signals += len(results)
+        self.assertGreater(signals, 0)
+
+
+class AssetTimelineTest(TestCase):
+    def test_timeline_signals_match_analyze(self):
+        shares, panel = create_market(seed=3), HistoryPanel.load(Share.objects.all())
+        analyzers = [AirAnalyzer(), BuyQueueAnalyzer(), CheapRightIssueAnalyzer(), GoodPriceRightIssueAnalyzer(),
+                     MACDCrossAnalyzer(), NewComerDropAnalyzer(), VolumeAnalyzer()]
+        timelines = {share.pk: AssetTimeline(share, panel.get_array(share)) for share in shares if share in panel}
+        since = Share.get_today_new(30)
+
+        signals = {}
+        for share_id, timeline in timelines.items():
+            for analyzer in analyzers:
+                for loc, signal, payload in analyzer.get_signals(timeline, timelines):
+                    day = HistoryStore.EPOCH + timedelta(days=int(timeline.days[loc]))
+                    if day >= since:
+                        signals.setdefault((share_id, day, type(analyzer).__name__), {signal: payload})
+
+        expected = {}
+        with panel.activate():
+            for day_offset in range(31):
+                history_cache.clear()
+                day = Share.get_today_new(day_offset)
+                for share in shares:
+                    if share.history_size(day_offset) == 0 or share.last_day_history(day_offset)['date'] != day:
+                        continue
+                    for analyzer in analyzers:
+                        if result := analyzer.analyze(share, day_offset):
+                            expected[(share.id, day, type(analyzer).__name__)] = result
+
+        self.assertEqual(signals, expected)
+        self.assertTrue({'MACDCrossAnalyzer', 'GoodPriceRightIssueAnalyzer'} <= {key[2] for key in expected})
+
+
+class DailyAnalyzeWorkersTest(TestCase):
+    def test_sharded_report_matches_single_process(self):
+        create_market(seed=4)
+        for day_offset in [0, 1]:
+            history_cache.clear()
+            with HistoryPanel.load(Share.objects.all()).activate() as panel:
+                row_list = DailyAnalyzeCommand().analyze(day_offset, panel)
+            self.assertTrue(any('option arbitrage' in row for row in row_list))
+            self.assertTrue(any('good price right issue' in row for row in row_list))
+
+            # a share per shard, rights issues and options are analyzed apart from their base shares
+            history_cache.clear()
+            shards_per_worker = Share.objects.count()
+            self.assertEqual(DailyAnalyzeCommand().analyze_in_workers(day_offset, 3, shards_per_worker), row_list)
@@ -1,5 +1,7 @@
-from datetime import datetime, time
+from datetime import datetime, time, date, timedelta
 
+import numpy as np
+from django.conf import settings
 from django.utils import timezone
 from django.utils.timezone import make_aware
 from persiantools.jdatetime import JalaliDate
@@ -41,6 +43,36 @@ def convert_time_string_to_time(string):
     return time(hour=int(hour), minute=int(minute), second=int(second))
 
 
+TRADING_WEEKMASK = '1110011'
+
+
+def get_holidays(from_date: date, to_date: date) -> list[date]:
+    """Market holidays of the settings in a range."""
+    holidays = [date.fromisoformat(day) for day in settings.MARKET_HOLIDAYS['DATES']]
+    for year in range(JalaliDate(from_date).year, JalaliDate(to_date).year + 1):
+        holidays += [JalaliDate(year, month, day).to_gregorian() for month, day in settings.MARKET_HOLIDAYS['JALALI']]
+    return sorted(day for day in set(holidays) if from_date <= day <= to_date)
+
+
+def is_trading_day(day: date) -> bool:
+    return day.isoweekday() not in [4, 5] and not get_holidays(day, day)
+
+
 def is_active_hour():
     now = timezone.localtime(timezone.now())
-    return now.isoweekday() not in [4, 5] and 17 >= now.hour >= 8
+    return is_trading_day(now.date()) and 17 >= now.hour >= 8
+
+
+def get_last_session_date() -> date:
+    """Last trading day whose session is over."""
+    now = timezone.localtime(timezone.now())
+    day = now.date() if now.hour > 17 else now.date() - timedelta(days=1)
+    while not is_trading_day(day):
+        day -= timedelta(days=1)
+    return day
+
+
+def count_trading_days(from_date: date, to_date: date) -> int:
+    """Trading days after from_date up to and including to_date."""
+    return int(np.busday_count(from_date + timedelta(days=1), to_date + timedelta(days=1), weekmask=TRADING_WEEKMASK,
+                               holidays=get_holidays(from_date + timedelta(days=1), to_date)))
@@ -94,6 +94,10 @@ DATABASES = {
         'NAME': BASE_DIR + "/" + 'stock.sql',
         'OPTIONS': {
             'timeout': 1000,  # in seconds
+            # write ahead log lets readers run beside the writer, page cache and memory map are 256MB and 1GB
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA cache_size=-262144; '
+                            'PRAGMA mmap_size=1073741824; PRAGMA temp_store=MEMORY;',
+            'transaction_mode': 'IMMEDIATE',
         },
         'USER': '',
         'PASSWORD': '',
@@ -127,6 +131,39 @@ CACHES = {
     }
 }
 
+# http response store, set HTTP_RESPONSE_STORE_MODE to record or replay for offline re-ingestion
+
+HTTP_RESPONSE_STORE = {
+    'MODE': os.getenv('HTTP_RESPONSE_STORE_MODE', 'off'),
+    'PATH': os.getenv('HTTP_RESPONSE_STORE_PATH', os.path.join(BASE_DIR, 'data', 'responses')),
+}
+
+# columnar copy of daily histories used as the read path of history handlers, set HISTORY_STORE_ENABLED to true
+
+HISTORY_STORE = {
+    'ENABLED': os.getenv('HISTORY_STORE_ENABLED', 'false').lower() == 'true',
+    'PATH': os.getenv('HISTORY_STORE_PATH', os.path.join(BASE_DIR, 'data', 'history')),
+}
+
+# history panels published after ingest and attached read only by other processes, set HISTORY_PANEL_ENABLED to true
+
+HISTORY_PANEL = {
+    'ENABLED': os.getenv('HISTORY_PANEL_ENABLED', 'false').lower() == 'true',
+    'PATH': os.getenv('HISTORY_PANEL_PATH', os.path.join(BASE_DIR, 'data', 'panel')),
+}
+
+# days the market is closed besides thursdays and fridays: jalali (month, day) holidays of every year and dates of the
+# lunar calendar ones, set MARKET_HOLIDAYS to a comma separated list of gregorian dates, e.g. 2025-03-31,2025-06-06
+
+MARKET_HOLIDAYS = {
+    'JALALI': [(1, 1), (1, 2), (1, 3), (1, 4), (1, 12), (1, 13), (3, 14), (3, 15), (11, 22), (12, 29)],
+    'DATES': [day.strip() for day in os.getenv('MARKET_HOLIDAYS', '').split(',') if day.strip()],
+}
+
+# memory bound of the in process cache of history handler results
+
+HISTORY_CACHE_MAX_BYTES = int(os.getenv('HISTORY_CACHE_MAX_BYTES', 512 * 2 ** 20))
+
 # logging
 
 LOGGING = {